@@ -2,6 +2,11 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
+from distributed import all_reduce_mean
+from storage import split_microbatches
+from timing import phase
+from utils import bf16_autocast
+
 from .kfac import KFACOptimizer
 
 
@@ -14,18 +19,33 @@ class A2C_ACKTR():
                  eps=None,
                  alpha=None,
                  max_grad_norm=None,
-                 acktr=False):
+                 acktr=False,
+                 use_bf16=False,
+                 microbatch_size=None,
+                 kfac_kwargs=None,
+                 fisher_sample_fraction=1.0):
 
         self.actor_critic = actor_critic
         self.acktr = acktr
+        self.use_bf16 = use_bf16
+
+        # The KFAC statistics hooks expect one forward pass per update
+        assert not (acktr and microbatch_size is not None), \
+            'Microbatching is not implemented for ACKTR'
+        self.microbatch_size = microbatch_size
 
         self.value_loss_coef = value_loss_coef
         self.entropy_coef = entropy_coef
 
         self.max_grad_norm = max_grad_norm
 
+        # Fraction of the batch used for the sampled Fisher statistics of ACKTR
+        self.fisher_sample_fraction = fisher_sample_fraction
+
         if acktr:
-            self.optimizer = KFACOptimizer(actor_critic)
+            if kfac_kwargs is None:
+                kfac_kwargs = {}
+            self.optimizer = KFACOptimizer(actor_critic, **kfac_kwargs)
         else:
             self.optimizer = optim.RMSprop(
                 actor_critic.parameters(), lr, eps=eps, alpha=alpha)
@@ -35,45 +55,88 @@ class A2C_ACKTR():
         action_shape = rollouts.actions.size()[-1]
         num_steps, num_processes, _ = rollouts.rewards.size()
 
-        values, action_log_probs, dist_entropy, _ = self.actor_critic.evaluate_actions(
-            rollouts.obs[:-1].view(-1, *obs_shape),
-            rollouts.recurrent_hidden_states[0].view(-1, self.actor_critic.recurrent_hidden_state_size),
-            rollouts.masks[:-1].view(-1, 1),
-            rollouts.actions.view(-1, action_shape))
+        batch = (rollouts.obs[:-1].view(-1, *obs_shape),
+                 rollouts.recurrent_hidden_states[0].view(-1, self.actor_critic.recurrent_hidden_state_size),
+                 rollouts.masks[:-1].view(-1, 1),
+                 rollouts.actions.view(-1, action_shape),
+                 rollouts.returns[:-1].view(-1, 1))
 
-        values = values.view(num_steps, num_processes, 1)
-        action_log_probs = action_log_probs.view(num_steps, num_processes, 1)
+        self.optimizer.zero_grad()
+        losses = torch.zeros(3, device=rollouts.obs.device)
 
-        advantages = rollouts.returns[:-1] - values
-        value_loss = advantages.pow(2).mean()
+        stats_step = self.acktr and self.optimizer.steps % self.optimizer.Ts == 0
+        subsample_fisher = stats_step and self.fisher_sample_fraction < 1.0
+        if subsample_fisher:
+            # The statistics come from a separate pass over a subset of the
+            # batch, so the loss pass does not need to record them
+            self.optimizer.acc_input_stats = False
 
-        action_loss = -(advantages.detach() * action_log_probs).mean()
+        # Microbatches are split along processes and their gradients are
+        # accumulated, which gives the same gradient as the full batch
+        for microbatch, weight in split_microbatches(batch, self.microbatch_size, num_processes):
+            obs_batch, recurrent_hidden_states_batch, masks_batch, actions_batch, return_batch = microbatch
 
-        if self.acktr and self.optimizer.steps % self.optimizer.Ts == 0:
-            # Sampled fisher, see Martens 2014
-            self.actor_critic.zero_grad()
-            pg_fisher_loss = -action_log_probs.mean()
+            with phase('update/forward'):
+                with bf16_autocast(self.use_bf16, obs_batch.device):
+                    values, action_log_probs, dist_entropy, _ = self.actor_critic.evaluate_actions(
+                        obs_batch, recurrent_hidden_states_batch, masks_batch, actions_batch)
+                # Keep the loss math in float32
+                values, action_log_probs, dist_entropy = \
+                    values.float(), action_log_probs.float(), dist_entropy.float()
 
-            value_noise = torch.randn(values.size())
-            if values.is_cuda:
-                value_noise = value_noise.cuda()
+                advantages = return_batch - values
+                value_loss = advantages.pow(2).mean()
 
-            sample_values = values + value_noise
-            vf_fisher_loss = -(values - sample_values.detach()).pow(2).mean()
+                action_loss = -(advantages.detach() * action_log_probs).mean()
 
-            fisher_loss = pg_fisher_loss + vf_fisher_loss
-            self.optimizer.acc_stats = True
-            fisher_loss.backward(retain_graph=True)
-            self.optimizer.acc_stats = False
+            if stats_step:
+                with phase('update/fisher'):
+                    # Sampled fisher, see Martens 2014
+                    self.actor_critic.zero_grad()
 
-        self.optimizer.zero_grad()
-        (value_loss * self.value_loss_coef + action_loss -
-         dist_entropy * self.entropy_coef).backward()
+                    fisher_values, fisher_action_log_probs = values, action_log_probs
+                    if subsample_fisher:
+                        num_samples = max(1, int(obs_batch.size(0) * self.fisher_sample_fraction))
+                        indices = torch.randperm(obs_batch.size(0), device=obs_batch.device)[:num_samples]
+
+                        # ACKTR has no recurrent policies, the hidden states are unused
+                        self.optimizer.acc_input_stats = True
+                        fisher_values, fisher_action_log_probs, _, _ = self.actor_critic.evaluate_actions(
+                            obs_batch[indices], recurrent_hidden_states_batch,
+                            masks_batch[indices], actions_batch[indices])
+
+                    pg_fisher_loss = -fisher_action_log_probs.mean()
+
+                    value_noise = torch.randn(fisher_values.size())
+                    if fisher_values.is_cuda:
+                        value_noise = value_noise.cuda()
+
+                    sample_values = fisher_values + value_noise
+                    vf_fisher_loss = -(fisher_values - sample_values.detach()).pow(2).mean()
+
+                    fisher_loss = pg_fisher_loss + vf_fisher_loss
+                    self.optimizer.acc_stats = True
+                    fisher_loss.backward(retain_graph=not subsample_fisher)
+                    self.optimizer.acc_stats = False
+
+                    self.optimizer.zero_grad()
+
+            with phase('update/backward'):
+                ((value_loss * self.value_loss_coef + action_loss -
+                  dist_entropy * self.entropy_coef) * weight).backward()
+
+            losses += weight * torch.stack([value_loss, action_loss, dist_entropy]).detach()
+
+        # Average gradients over data-parallel learners (no-op for a single learner)
+        with phase('update/all_reduce'):
+            all_reduce_mean([p.grad for p in self.actor_critic.parameters()])
 
-        if self.acktr == False:
-            nn.utils.clip_grad_norm_(self.actor_critic.parameters(),
-                                     self.max_grad_norm)
+        with phase('update/optimizer'):
+            if self.acktr == False:
+                nn.utils.clip_grad_norm_(self.actor_critic.parameters(),
+                                         self.max_grad_norm)
 
-        self.optimizer.step()
+            self.optimizer.step()
 
-        return value_loss.item(), action_loss.item(), dist_entropy.item()
+        value_loss, action_loss, dist_entropy = losses.tolist()
+        return value_loss, action_loss, dist_entropy
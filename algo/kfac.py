@@ -1,42 +1,84 @@
 import math
+import threading
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
-from utils import AddBias
+from distributed import all_reduce_mean, is_distributed
+from timing import phase
+from utils import split_bias
+# Checkpoints pickled before SplitBias moved to utils refer to algo.kfac.SplitBias
+from utils import SplitBias  # noqa: F401
 
 # TODO: In order to make this code faster:
-# 1) Implement _extract_patches as a single cuda kernel
-# 2) Compute QR decomposition in a separate process
+# 1) Implement _extract_patches as a single cuda kernel (patches are now
+#    unfolded in bands of output rows, see _patch_chunks)
+# 2) Compute QR decomposition in a separate process (see async_eig, it uses
+#    a background thread since torch releases the GIL inside eigh)
 # 3) Actually make a general KFAC optimizer so it fits PyTorch
 
+# Max number of patch elements unfolded at once when computing Conv2d
+# activation covariances, bounds the peak memory of compute_cov_a
+COV_CHUNK_ELEMENTS = 1 << 22
 
-def _extract_patches(x, kernel_size, stride, padding):
+
+def _patch_chunks(x, kernel_size, stride, padding, max_elements=COV_CHUNK_ELEMENTS):
+    """Unfold conv input patches in bands of output rows.
+
+    Yields (batch, C * kh * kw, positions) tensors whose rows are in the same
+    (C, kh, kw) order as the flattened conv weight, with at most max_elements
+    elements each.
+    """
     if padding[0] + padding[1] > 0:
-        x = F.pad(x, (padding[1], padding[1], padding[0],
-                      padding[0])).data  # Actually check dims
-    x = x.unfold(2, kernel_size[0], stride[0])
-    x = x.unfold(3, kernel_size[1], stride[1])
-    x = x.transpose_(1, 2).transpose_(2, 3).contiguous()
-    x = x.view(
-        x.size(0), x.size(1), x.size(2),
-        x.size(3) * x.size(4) * x.size(5))
-    return x
+        x = F.pad(x, (padding[1], padding[1], padding[0], padding[0]))
+
+    out_h = (x.size(2) - kernel_size[0]) // stride[0] + 1
+    out_w = (x.size(3) - kernel_size[1]) // stride[1] + 1
+    patch_size = x.size(1) * kernel_size[0] * kernel_size[1]
+    rows = max(1, max_elements // (x.size(0) * out_w * patch_size))
+
+    for start in range(0, out_h, rows):
+        end = min(start + rows, out_h)
+        band = x[:, :, start * stride[0]:(end - 1) * stride[0] + kernel_size[0]]
+        yield F.unfold(band, kernel_size, stride=stride)
+
+
+def _patch_means(x, kernel_size, stride, padding):
+    """Mean of the conv input patches over output positions, (batch, C * kh * kw)."""
+    if padding[0] + padding[1] > 0:
+        x = F.pad(x, (padding[1], padding[1], padding[0], padding[0]))
+
+    out_h = (x.size(2) - kernel_size[0]) // stride[0] + 1
+    out_w = (x.size(3) - kernel_size[1]) // stride[1] + 1
+
+    means = x.new_empty(x.size(0), x.size(1), kernel_size[0], kernel_size[1])
+    for i in range(kernel_size[0]):
+        for j in range(kernel_size[1]):
+            means[:, :, i, j] = x[:, :, i:i + (out_h - 1) * stride[0] + 1:stride[0],
+                                  j:j + (out_w - 1) * stride[1] + 1:stride[1]].mean((2, 3))
+    return means.view(x.size(0), -1)
 
 
 def compute_cov_a(a, classname, layer_info, fast_cnn):
     batch_size = a.size(0)
 
     if classname == 'Conv2d':
+        kernel_size, stride, padding = layer_info
+        num_positions = 0
         if fast_cnn:
-            a = _extract_patches(a, *layer_info)
-            a = a.view(a.size(0), -1, a.size(-1))
-            a = a.mean(1)
+            # Covariance of the patches averaged over spatial positions, the
+            # average is taken per kernel offset without unfolding
+            a = _patch_means(a, kernel_size, stride, padding)
         else:
-            a = _extract_patches(a, *layer_info)
-            a = a.view(-1, a.size(-1)).div_(a.size(1)).div_(a.size(2))
+            # Covariance over all patches, scaled by 1 / positions^2
+            cov = 0
+            for patches in _patch_chunks(a, kernel_size, stride, padding):
+                patches = patches.transpose(1, 2).reshape(-1, patches.size(1))
+                cov = cov + patches.t() @ patches
+                num_positions += patches.size(0) // batch_size
+            return cov / (num_positions * num_positions * batch_size)
     elif classname == 'AddBias':
         is_cuda = a.is_cuda
         a = torch.ones(a.size(0), 1)
@@ -71,17 +113,179 @@ def update_running_stat(aa, m_aa, momentum):
     m_aa *= (1 - momentum)
 
 
-class SplitBias(nn.Module):
-    def __init__(self, module):
-        super(SplitBias, self).__init__()
-        self.module = module
-        self.add_bias = AddBias(module.bias.data)
-        self.module.bias = None
-
-    def forward(self, input):
-        x = self.module(input)
-        x = self.add_bias(x)
-        return x
+def randomized_eigh(m, rank, oversample=10, n_iter=2):
+    """Approximate the top-rank eigenpairs of a symmetric PSD matrix.
+
+    Randomized range finder with power iterations (Halko et al. 2011), costs
+    O(n^2 * rank) instead of O(n^3). Returns eigenvalues in ascending order.
+    """
+    n = m.size(0)
+    omega = torch.randn(n, min(n, rank + oversample), device=m.device, dtype=m.dtype)
+    y = m @ omega
+    for _ in range(n_iter):
+        y, _ = torch.linalg.qr(y)
+        y = m @ y
+    q, _ = torch.linalg.qr(y)
+
+    d, v = torch.linalg.eigh(q.t() @ m @ q)
+    return d[-rank:], q @ v[:, -rank:]
+
+
+def _eigh(factors, low_rank, low_rank_threshold):
+    """Eigendecompose a dict of factors.
+
+    Factors of the same shape are decomposed in one batched call. Factors
+    larger than low_rank_threshold (and than low_rank, otherwise there is no
+    remainder) are approximated by their top low_rank eigenpairs plus an
+    isotropic remainder, whose eigenvalue (the mean of the discarded
+    spectrum) is returned in the third dict (None for exact factors).
+    """
+    d, Q, sigma = {}, {}, {}
+
+    groups = {}
+    for m, f in factors.items():
+        if low_rank is not None and f.size(0) > max(low_rank_threshold, low_rank):
+            d[m], Q[m] = randomized_eigh(f, low_rank)
+            sigma[m] = ((f.trace() - d[m].sum()) / (f.size(0) - low_rank)).clamp(min=0)
+        else:
+            groups.setdefault((f.size(), f.dtype, f.device), []).append(m)
+            sigma[m] = None
+
+    for modules in groups.values():
+        if len(modules) == 1:
+            d[modules[0]], Q[modules[0]] = torch.linalg.eigh(factors[modules[0]])
+            continue
+        # eigh decomposes a stack of matrices in one call
+        ds, Qs = torch.linalg.eigh(torch.stack([factors[m] for m in modules]))
+        for i, m in enumerate(modules):
+            d[m], Q[m] = ds[i], Qs[i]
+
+    for m in d:
+        d[m].mul_((d[m] > 1e-6).float())
+
+    return d, Q, sigma
+
+
+def compute_eigenbasis(m_aa, m_gg, low_rank=None, low_rank_threshold=1024):
+    """Eigendecompose the Kronecker factors of every layer.
+
+    Returns the dicts (d_a, Q_a, sigma_a, d_g, Q_g, sigma_g), keyed like the
+    factors, see _eigh for sigma.
+    """
+    d_a, Q_a, sigma_a = _eigh(m_aa, low_rank, low_rank_threshold)
+    d_g, Q_g, sigma_g = _eigh(m_gg, low_rank, low_rank_threshold)
+    return d_a, Q_a, sigma_a, d_g, Q_g, sigma_g
+
+
+def precondition(grad, d_g, Q_g, sigma_g, d_a, Q_a, sigma_a, la):
+    """Multiply a (out, in) gradient by the inverse of the damped Kronecker factors.
+
+    With truncated eigenbases the gradient is split into its components in the
+    span of Q_g/Q_a and in their orthogonal complements, which are scaled by
+    the remainder eigenvalues sigma_g/sigma_a.
+    """
+    v1 = Q_g.t() @ grad @ Q_a
+    v2 = v1 / (d_g.unsqueeze(1) * d_a.unsqueeze(0) + la)
+    v = Q_g @ v2 @ Q_a.t()
+
+    if sigma_a is None and sigma_g is None:
+        return v
+
+    grad_a = grad @ Q_a
+    grad_g = Q_g.t() @ grad
+    if sigma_a is not None:
+        # Q_g^T grad (I - Q_a Q_a^T)
+        v12 = grad_g - v1 @ Q_a.t()
+        v = v + Q_g @ (v12 / (d_g.unsqueeze(1) * sigma_a + la))
+    if sigma_g is not None:
+        # (I - Q_g Q_g^T) grad Q_a
+        v21 = grad_a - Q_g @ v1
+        v = v + (v21 / (sigma_g * d_a.unsqueeze(0) + la)) @ Q_a.t()
+    if sigma_a is not None and sigma_g is not None:
+        # (I - Q_g Q_g^T) grad (I - Q_a Q_a^T)
+        v22 = grad - Q_g @ grad_g - grad_a @ Q_a.t() + Q_g @ v1 @ Q_a.t()
+        v = v + v22 / (sigma_g * sigma_a + la)
+
+    return v
+
+
+class EigenbasisWorker(object):
+    """Computes eigenbases of factor snapshots on a background thread.
+
+    At most one snapshot is in flight; `result` is replaced as a whole by a
+    (step, eigenbasis) tuple once a snapshot is done, so readers always see a
+    consistent eigenbasis. An exception of the eigendecomposition is raised
+    again by the next submit() or wait().
+    """
+    def __init__(self, eigenbasis_fn):
+        self.eigenbasis_fn = eigenbasis_fn
+        self.result = None
+        self.skipped = 0
+        self.error = None
+
+        self._job = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._pending = threading.Event()
+        self._published = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, step, m_aa, m_gg):
+        self._check()
+        # Keep using the previous eigenbasis if the last snapshot is not done yet
+        if not self._idle.is_set():
+            self.skipped += 1
+            return False
+
+        self._idle.clear()
+        self._job = (step,
+                     {m: f.clone() for m, f in m_aa.items()},
+                     {m: f.clone() for m, f in m_gg.items()})
+        self._pending.set()
+        return True
+
+    def wait(self):
+        """Block until there is a result."""
+        self._published.wait()
+        self._check()
+
+    def wait_idle(self):
+        """Block until the snapshot in flight, if any, is done."""
+        self._idle.wait()
+        self._check()
+
+    def publish(self, step, eigenbasis):
+        """Set the result directly, e.g. to an eigenbasis loaded from a checkpoint."""
+        self.result = (step, eigenbasis)
+        self._published.set()
+
+    def close(self):
+        """Stop the thread once the snapshot in flight, if any, is done."""
+        # A None job is the stop sentinel
+        self._job = None
+        self._pending.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            if self._job is None:
+                return
+            step, m_aa, m_gg = self._job
+            try:
+                self.result = (step, self.eigenbasis_fn(m_aa, m_gg))
+            except Exception as e:
+                # Wake up the waiters, they raise it
+                self.error = e
+            self._published.set()
+            self._idle.set()
 
 
 class KFACOptimizer(optim.Optimizer):
@@ -95,16 +299,12 @@ class KFACOptimizer(optim.Optimizer):
                  weight_decay=0,
                  fast_cnn=False,
                  Ts=1,
-                 Tf=10):
+                 Tf=10,
+                 async_eig=False,
+                 low_rank=None,
+                 low_rank_threshold=1024):
         defaults = dict()
 
-        def split_bias(module):
-            for mname, child in module.named_children():
-                if hasattr(child, 'bias') and child.bias is not None:
-                    module._modules[mname] = SplitBias(child)
-                else:
-                    split_bias(child)
-
         split_bias(model)
 
         super(KFACOptimizer, self).__init__(model.parameters(), defaults)
@@ -119,9 +319,14 @@ class KFACOptimizer(optim.Optimizer):
 
         self.steps = 0
 
+        # Toggled by the agent around the passes that accumulate statistics
+        self.acc_stats = False
+        self.acc_input_stats = True
+
         self.m_aa, self.m_gg = {}, {}
         self.Q_a, self.Q_g = {}, {}
         self.d_a, self.d_g = {}, {}
+        self.sigma_a, self.sigma_g = {}, {}
 
         self.momentum = momentum
         self.stat_decay = stat_decay
@@ -136,13 +341,24 @@ class KFACOptimizer(optim.Optimizer):
         self.Ts = Ts
         self.Tf = Tf
 
+        # Step at which the factors of the current eigenbasis were taken, the
+        # eigenbasis is eig_staleness steps old when async_eig is used
+        self.eig_step = 0
+        self.eig_staleness = 0
+        self.eig_worker = EigenbasisWorker(self._compute_eigenbasis) if async_eig else None
+
+        # Factors larger than low_rank_threshold keep only their top low_rank
+        # eigenpairs (None for exact eigendecompositions)
+        self.low_rank = low_rank
+        self.low_rank_threshold = low_rank_threshold
+
         self.optim = optim.SGD(
             model.parameters(),
             lr=self.lr * (1 - self.momentum),
             momentum=self.momentum)
 
     def _save_input(self, module, input):
-        if torch.is_grad_enabled() and self.steps % self.Ts == 0:
+        if torch.is_grad_enabled() and self.acc_input_stats and self.steps % self.Ts == 0:
             classname = module.__class__.__name__
             layer_info = None
             if classname == 'Conv2d':
@@ -187,12 +403,80 @@ class KFACOptimizer(optim.Optimizer):
                 module.register_forward_pre_hook(self._save_input)
                 module.register_backward_hook(self._save_grad_output)
 
+    def _compute_eigenbasis(self, m_aa, m_gg):
+        return compute_eigenbasis(m_aa, m_gg, self.low_rank, self.low_rank_threshold)
+
+    def _set_eigenbasis(self, step, eigenbasis):
+        self.eig_step = step
+        self.d_a, self.Q_a, self.sigma_a, self.d_g, self.Q_g, self.sigma_g = eigenbasis
+
+    def state_dict(self):
+        """Kronecker factors, eigenbases and momentum buffers, keyed by layer index."""
+        index = {m: i for i, m in enumerate(self.modules)}
+
+        def by_index(stats):
+            return {index[m]: v for m, v in stats.items()}
+
+        return {
+            'steps': self.steps,
+            'eig_step': self.eig_step,
+            'm_aa': by_index(self.m_aa),
+            'm_gg': by_index(self.m_gg),
+            'eigenbasis': [by_index(stats) for stats in (self.d_a, self.Q_a, self.sigma_a,
+                                                         self.d_g, self.Q_g, self.sigma_g)],
+            'optim': self.optim.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict):
+        device = next(self.model.parameters()).device
+
+        def by_module(stats):
+            return {self.modules[i]: v.to(device) if torch.is_tensor(v) else v
+                    for i, v in stats.items()}
+
+        self.steps = state_dict['steps']
+        self.m_aa = by_module(state_dict['m_aa'])
+        self.m_gg = by_module(state_dict['m_gg'])
+        eigenbasis = tuple(by_module(stats) for stats in state_dict['eigenbasis'])
+        self._set_eigenbasis(state_dict['eig_step'], eigenbasis)
+        if self.eig_worker is not None:
+            self.eig_worker.publish(self.eig_step, eigenbasis)
+        self.optim.load_state_dict(state_dict['optim'])
+
     def step(self):
         # Add weight decay
         if self.weight_decay > 0:
             for p in self.model.parameters():
                 p.grad.data.add_(self.weight_decay, p.data)
 
+        if self.steps % self.Tf == 0:
+            # Keep the Kronecker factors identical across data-parallel learners
+            all_reduce_mean([self.m_aa[m] for m in self.modules] +
+                            [self.m_gg[m] for m in self.modules])
+
+            if self.eig_worker is None:
+                with phase('update/kfac_eig'):
+                    self._set_eigenbasis(self.steps, self._compute_eigenbasis(self.m_aa, self.m_gg))
+            else:
+                if is_distributed() and self.eig_worker.result is not None:
+                    # Data-parallel learners must precondition with the same
+                    # eigenbasis: each adopts the previous snapshot's exactly
+                    # Tf steps after it was taken, waiting for it if needed
+                    with phase('update/kfac_eig_wait'):
+                        self.eig_worker.wait_idle()
+                    self._set_eigenbasis(*self.eig_worker.result)
+                self.eig_worker.submit(self.steps, self.m_aa, self.m_gg)
+
+        if self.eig_worker is not None and (not is_distributed() or not self.Q_a):
+            # The very first step has no previous eigenbasis to fall back on
+            with phase('update/kfac_eig_wait'):
+                self.eig_worker.wait()
+            eig_step, eigenbasis = self.eig_worker.result
+            if eig_step != self.eig_step or not self.Q_a:
+                self._set_eigenbasis(eig_step, eigenbasis)
+
+        self.eig_staleness = self.steps - self.eig_step
+
         updates = {}
         for i, m in enumerate(self.modules):
             assert len(list(m.parameters())
@@ -202,26 +486,14 @@ class KFACOptimizer(optim.Optimizer):
 
             la = self.damping + self.weight_decay
 
-            if self.steps % self.Tf == 0:
-                # My asynchronous implementation exists, I will add it later.
-                # Experimenting with different ways to this in PyTorch.
-                self.d_a[m], self.Q_a[m] = torch.symeig(
-                    self.m_aa[m], eigenvectors=True)
-                self.d_g[m], self.Q_g[m] = torch.symeig(
-                    self.m_gg[m], eigenvectors=True)
-
-                self.d_a[m].mul_((self.d_a[m] > 1e-6).float())
-                self.d_g[m].mul_((self.d_g[m] > 1e-6).float())
-
             if classname == 'Conv2d':
                 p_grad_mat = p.grad.data.view(p.grad.data.size(0), -1)
             else:
                 p_grad_mat = p.grad.data
 
-            v1 = self.Q_g[m].t() @ p_grad_mat @ self.Q_a[m]
-            v2 = v1 / (
-                self.d_g[m].unsqueeze(1) * self.d_a[m].unsqueeze(0) + la)
-            v = self.Q_g[m] @ v2 @ self.Q_a[m].t()
+            v = precondition(p_grad_mat,
+                             self.d_g[m], self.Q_g[m], self.sigma_g[m],
+                             self.d_a[m], self.Q_a[m], self.sigma_a[m], la)
 
             v = v.view(p.grad.data.size())
             updates[p] = v
@@ -1,8 +1,14 @@
+import time
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from rl_algos.utils import one_hot
+
+from distributed import all_reduce_mean
+from storage import split_microbatches
+from timing import phase
+from utils import bf16_autocast
 
 
 class PPO(object):
@@ -16,7 +22,10 @@ class PPO(object):
                  lr=None,
                  eps=None,
                  max_grad_norm=None,
-                 use_clipped_value_loss=True):
+                 use_clipped_value_loss=True,
+                 use_bf16=False,
+                 target_kl=None,
+                 microbatch_size=None):
 
         self.actor_critic = actor_critic
 
@@ -29,69 +38,153 @@ class PPO(object):
 
         self.max_grad_norm = max_grad_norm
         self.use_clipped_value_loss = use_clipped_value_loss
+        self.use_bf16 = use_bf16
+
+        # Stop the update early once the approximate KL between the old and
+        # new policy exceeds 1.5 * target_kl
+        self.target_kl = target_kl
+        self.epochs_run = ppo_epoch
+        # Estimated time of the skipped minibatch updates. The minibatch that
+        # trips the KL check has already run its forward, backward and
+        # all-reduce, so that pass is wasted but counted as saved
+        self.update_time_saved = 0.
+
+        # Split every minibatch into chunks of at most microbatch_size samples
+        self.microbatch_size = microbatch_size
 
         self.optimizer = optim.Adam(actor_critic.parameters(), lr=lr, eps=eps)
 
+        # Extra statistics of the last update, see _finish_update
+        self.stats = {}
+
+    def _explained_variance(self, rollouts):
+        returns = rollouts.returns[:-1]
+        return 1 - (returns - rollouts.value_preds[:-1]).var() / (returns.var() + 1e-8)
+
+    def _finish_update(self, stats_epoch, num_updates, explained_variance):
+        stats_epoch = stats_epoch / max(num_updates, 1)
+        value_loss, action_loss, dist_entropy, clip_fraction, approx_kl, explained_variance = \
+            torch.cat([stats_epoch, explained_variance.view(1)]).tolist()
+
+        self.stats = {
+            'clip_fraction': clip_fraction,
+            'approx_kl': approx_kl,
+            'explained_variance': explained_variance,
+        }
+
+        return value_loss, action_loss, dist_entropy
+
+    def _data_generator(self, rollouts, advantages):
+        if self.actor_critic.is_recurrent:
+            return rollouts.recurrent_generator(
+                advantages, self.num_mini_batch)
+        return rollouts.feed_forward_generator(
+            advantages, self.num_mini_batch)
+
+    def _policy_losses(self, sample):
+        obs_batch, recurrent_hidden_states_batch, actions_batch, \
+           value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, \
+                adv_targ = sample[:8]
+
+        # Reshape to do in a single forward pass for all steps
+        with bf16_autocast(self.use_bf16, obs_batch.device):
+            values, action_log_probs, dist_entropy, _ = self.actor_critic.evaluate_actions(
+                obs_batch, recurrent_hidden_states_batch,
+                masks_batch, actions_batch)
+        # Keep the loss math (ratio, clipping) in float32
+        values, action_log_probs, dist_entropy = \
+            values.float(), action_log_probs.float(), dist_entropy.float()
+
+        ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
+        surr1 = ratio * adv_targ
+        surr2 = torch.clamp(ratio, 1.0 - self.clip_param,
+                                   1.0 + self.clip_param) * adv_targ
+        action_loss = -torch.min(surr1, surr2).mean()
+
+        if self.use_clipped_value_loss:
+            value_pred_clipped = value_preds_batch + \
+                (values - value_preds_batch).clamp(-self.clip_param, self.clip_param)
+            value_losses = (values - return_batch).pow(2)
+            value_losses_clipped = (value_pred_clipped - return_batch).pow(2)
+            value_loss = 0.5 * torch.max(value_losses, value_losses_clipped).mean()
+        else:
+            value_loss = 0.5 * (return_batch - values).pow(2).mean()
+
+        with torch.no_grad():
+            approx_kl = (old_action_log_probs_batch - action_log_probs).mean()
+            clip_fraction = ((ratio - 1.0).abs() > self.clip_param).float().mean()
+            stats = torch.stack([value_loss, action_loss, dist_entropy,
+                                 clip_fraction, approx_kl])
+
+        return value_loss, action_loss, dist_entropy, stats
+
+    def _loss(self, sample, weight):
+        """Returns the loss of a (micro)batch scaled by weight and its statistics."""
+        value_loss, action_loss, dist_entropy, stats = self._policy_losses(sample)
+        loss = value_loss * self.value_loss_coef + action_loss - dist_entropy * self.entropy_coef
+        return loss * weight, stats
+
     def update(self, rollouts):
         advantages = rollouts.returns[:-1] - rollouts.value_preds[:-1]
         advantages = (advantages - advantages.mean()) / (
             advantages.std() + 1e-5)
 
-        value_loss_epoch = 0
-        action_loss_epoch = 0
-        dist_entropy_epoch = 0
+        # value loss, action loss, entropy, clip fraction and approx KL summed
+        # over minibatches on the device, synchronized once at the end
+        stats_epoch = torch.zeros(5, device=advantages.device)
+        explained_variance = self._explained_variance(rollouts)
+
+        start = time.time()
+        num_updates = 0
+        epochs_run = 0
+        early_stop = False
 
         for e in range(self.ppo_epoch):
-            if self.actor_critic.is_recurrent:
-                data_generator = rollouts.recurrent_generator(
-                    advantages, self.num_mini_batch)
-            else:
-                data_generator = rollouts.feed_forward_generator(
-                    advantages, self.num_mini_batch)
+            epochs_run += 1
+            data_generator = self._data_generator(rollouts, advantages)
 
             for sample in data_generator:
-                obs_batch, recurrent_hidden_states_batch, actions_batch, \
-                   value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, \
-                        adv_targ = sample
-
-                # Reshape to do in a single forward pass for all steps
-                values, action_log_probs, dist_entropy, _ = self.actor_critic.evaluate_actions(
-                    obs_batch, recurrent_hidden_states_batch,
-                    masks_batch, actions_batch)
-
-                ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
-                surr1 = ratio * adv_targ
-                surr2 = torch.clamp(ratio, 1.0 - self.clip_param,
-                                           1.0 + self.clip_param) * adv_targ
-                action_loss = -torch.min(surr1, surr2).mean()
-
-                if self.use_clipped_value_loss:
-                    value_pred_clipped = value_preds_batch + \
-                        (values - value_preds_batch).clamp(-self.clip_param, self.clip_param)
-                    value_losses = (values - return_batch).pow(2)
-                    value_losses_clipped = (value_pred_clipped - return_batch).pow(2)
-                    value_loss = 0.5 * torch.max(value_losses, value_losses_clipped).mean()
-                else:
-                    value_loss = 0.5 * (return_batch - values).pow(2).mean()
+                num_envs = sample[1].size(0) if self.actor_critic.is_recurrent else None
 
+                # Accumulate gradients over microbatches, this bounds peak
+                # activation memory and gives the same gradient as the minibatch
                 self.optimizer.zero_grad()
-                (value_loss * self.value_loss_coef + action_loss -
-                 dist_entropy * self.entropy_coef).backward()
-                nn.utils.clip_grad_norm_(self.actor_critic.parameters(),
-                                         self.max_grad_norm)
-                self.optimizer.step()
+                stats = torch.zeros(5, device=advantages.device)
+                for microbatch, weight in split_microbatches(sample, self.microbatch_size, num_envs):
+                    with phase('update/forward'):
+                        loss, microbatch_stats = self._loss(microbatch, weight)
+                    with phase('update/backward'):
+                        loss.backward()
+                    stats += weight * microbatch_stats
+
+                # Average gradients and statistics over data-parallel learners
+                # (no-op for a single learner)
+                with phase('update/all_reduce'):
+                    all_reduce_mean([p.grad for p in self.actor_critic.parameters()] + [stats])
+
+                # Early stopping needs the value on the host, this is the only
+                # per-minibatch sync and only happens when target_kl is set
+                if self.target_kl is not None and stats[4].item() > 1.5 * self.target_kl:
+                    early_stop = True
+                    break
 
-                value_loss_epoch += value_loss.item()
-                action_loss_epoch += action_loss.item()
-                dist_entropy_epoch += dist_entropy.item()
+                with phase('update/optimizer'):
+                    nn.utils.clip_grad_norm_(self.actor_critic.parameters(),
+                                             self.max_grad_norm)
+                    self.optimizer.step()
 
-        num_updates = self.ppo_epoch * self.num_mini_batch
+                stats_epoch += stats
+                num_updates += 1
 
-        value_loss_epoch /= num_updates
-        action_loss_epoch /= num_updates
-        dist_entropy_epoch /= num_updates
+            if early_stop:
+                break
 
-        return value_loss_epoch, action_loss_epoch, dist_entropy_epoch
+        self.epochs_run = epochs_run
+        planned_updates = self.ppo_epoch * self.num_mini_batch
+        self.update_time_saved = (time.time() - start) / max(num_updates, 1) * \
+            (planned_updates - num_updates)
+
+        return self._finish_update(stats_epoch, num_updates, explained_variance)
 
 
 class CuriosityPPO(PPO):
@@ -125,103 +218,45 @@ class CuriosityPPO(PPO):
 
         super(CuriosityPPO, self).__init__(**kwargs)
 
-    def update(self, rollouts):
-        advantages = rollouts.returns[:-1] - rollouts.value_preds[:-1]
-        advantages = (advantages - advantages.mean()) / (
-            advantages.std() + 1e-5)
+    def _data_generator(self, rollouts, advantages):
+        if self.actor_critic.is_recurrent:
+            return rollouts.recurrent_generator(
+                advantages, self.num_mini_batch, curiosity=True)
+        return rollouts.feed_forward_generator(
+            advantages, self.num_mini_batch, curiosity=True)
 
-        value_loss_epoch = 0
-        action_loss_epoch = 0
-        dist_entropy_epoch = 0
+    def _loss(self, sample, weight):
+        from rl_algos.utils import one_hot
 
-        for e in range(self.ppo_epoch):
-            if self.actor_critic.is_recurrent:
-                data_generator = rollouts.recurrent_generator(
-                    advantages, self.num_mini_batch, curiosity=True)
-            else:
-                data_generator = rollouts.feed_forward_generator(
-                    advantages, self.num_mini_batch, curiosity=True)
+        obs_batch, actions_batch, prev_obs_batch = sample[0], sample[2], sample[8]
 
-            for sample in data_generator:
-                obs_batch, recurrent_hidden_states_batch, actions_batch, \
-                   value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, \
-                        adv_targ, prev_obs_batch = sample
-
-                # Reshape to do in a single forward pass for all steps
-                values, action_log_probs, dist_entropy, _ = self.actor_critic.evaluate_actions(
-                    obs_batch, recurrent_hidden_states_batch,
-                    masks_batch, actions_batch)
-
-                features_batch = self.feature_encoder(obs_batch)
-                prev_features_batch = self.feature_encoder(prev_obs_batch)
-                action_pred_batch = self.inverse_model(prev_features_batch, features_batch)
-                features_pred_batch = self.forward_model(prev_features_batch,
-                                                         one_hot(actions_batch, max_val=self.forward_model.action_size))
-
-                ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
-                surr1 = ratio * adv_targ
-                surr2 = torch.clamp(ratio, 1.0 - self.clip_param,
-                                           1.0 + self.clip_param) * adv_targ
-                action_loss = -torch.min(surr1, surr2).mean()
-
-                if self.use_clipped_value_loss:
-                    value_pred_clipped = value_preds_batch + \
-                        (values - value_preds_batch).clamp(-self.clip_param, self.clip_param)
-                    value_losses = (values - return_batch).pow(2)
-                    value_losses_clipped = (value_pred_clipped - return_batch).pow(2)
-                    value_loss = 0.5 * torch.max(value_losses, value_losses_clipped).mean()
-                else:
-                    value_loss = 0.5 * (return_batch - values).pow(2).mean()
+        value_loss, action_loss, dist_entropy, stats = self._policy_losses(sample)
 
-                self.optimizer.zero_grad()
+        # Encode both observations in one batched pass
+        prev_features_batch, features_batch = self.feature_encoder(
+            torch.cat([prev_obs_batch, obs_batch])).chunk(2)
+        action_pred_batch = self.inverse_model(prev_features_batch, features_batch)
+        features_pred_batch = self.forward_model(prev_features_batch,
+                                                 one_hot(actions_batch, max_val=self.forward_model.action_size))
+
+        policy_loss = value_loss * self.value_loss_coef + action_loss - dist_entropy * self.entropy_coef
+
+        # NOTE: inverse loss will depend on the type of action space
+        one_hot_actions_batch = one_hot(actions_batch, max_val=self.forward_model.action_size).float()
+        # inverse_loss = self.forward_loss_fn(action_pred_batch, actions_batch)
+        # inverse_loss = self.forward_loss_fn(action_pred_batch, one_hot_actions_batch)
+        # inverse_loss = -(actions_batch * torch.log(action_pred_batch + 1e-15)).sum(1)
+        # inverse_loss = -(one_hot_actions_batch * torch.log(action_pred_batch + 1e-15)).sum(1)
+        inverse_loss = -(one_hot_actions_batch * torch.log(action_pred_batch + 1e-15)).sum()
+
+        # forward_loss = 0.5 * torch.sum((features_pred_batch - features_batch) ** 2, 1)
+        forward_loss = 0.5 * torch.sum((features_pred_batch - features_batch) ** 2, 1).sum()
+
+        # Weighting of forward and inverse loss with the policy loss.
+        # The forward and inverse losses are sums over the batch, so they are
+        # not scaled by the microbatch weight
+        loss = self.lam_pol * policy_loss * weight + \
+               (1 - self.forward_loss_weight) * inverse_loss + \
+               self.forward_loss_weight * forward_loss
 
-                policy_loss = value_loss * self.value_loss_coef + action_loss - dist_entropy * self.entropy_coef
-
-                # NOTE: inverse loss will depend on the type of action space
-                # print("action_pred_batch shape", action_pred_batch.shape)
-                # print("actions_batch shape", actions_batch.shape)
-                # print("action_pred_batch type", action_pred_batch.dtype)
-                # print("actions_batch type", actions_batch.dtype)
-                # print("one hotted actions_batch shape", one_hot(actions_batch, max_val=self.forward_model.action_size).shape)
-                one_hot_actions_batch = one_hot(actions_batch, max_val=self.forward_model.action_size).float()
-                # print("one hotted actions_batch type", one_hot_actions_batch.dtype)
-                # inverse_loss = self.forward_loss_fn(action_pred_batch, actions_batch)
-                # inverse_loss = self.forward_loss_fn(action_pred_batch, one_hot_actions_batch)
-                # inverse_loss = -(actions_batch * torch.log(action_pred_batch + 1e-15)).sum(1)
-                # inverse_loss = -(one_hot_actions_batch * torch.log(action_pred_batch + 1e-15)).sum(1)
-                inverse_loss = -(one_hot_actions_batch * torch.log(action_pred_batch + 1e-15)).sum()
-
-                # forward_loss = 0.5 * torch.sum((features_pred_batch - features_batch) ** 2, 1)
-                forward_loss = 0.5 * torch.sum((features_pred_batch - features_batch) ** 2, 1).sum()
-
-                # Weighting of forward and inverse loss with the policy loss
-                loss = self.lam_pol * policy_loss + \
-                       (1 - self.forward_loss_weight) * inverse_loss + \
-                       self.forward_loss_weight * forward_loss
-
-                # print("")
-                # print("value loss shape", value_loss.shape)
-                # print("action loss shape", action_loss.shape)
-                # print("forward loss shape", forward_loss.shape)
-                # print("inverse loss shape", inverse_loss.shape)
-                # print("policy loss shape", policy_loss.shape)
-                # print("loss shape", loss.shape)
-                # print(policy_loss.item())
-                # print(loss.item())
-
-                loss.backward()
-                nn.utils.clip_grad_norm_(self.actor_critic.parameters(),
-                                         self.max_grad_norm)
-                self.optimizer.step()
-
-                value_loss_epoch += value_loss.item()
-                action_loss_epoch += action_loss.item()
-                dist_entropy_epoch += dist_entropy.item()
-
-        num_updates = self.ppo_epoch * self.num_mini_batch
-
-        value_loss_epoch /= num_updates
-        action_loss_epoch /= num_updates
-        dist_entropy_epoch /= num_updates
-
-        return value_loss_epoch, action_loss_epoch, dist_entropy_epoch
+        return loss, stats
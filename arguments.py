@@ -1,9 +1,16 @@
 import argparse
+import json
 
 import torch
 
 
-def get_args():
+def get_args(argv=None, config=None):
+    """Parse argv (default: sys.argv[1:]).
+
+    config is a dict of argument defaults keyed by dest name, like the
+    --config file, which it takes precedence over. Unknown keys raise a
+    ValueError.
+    """
     parser = argparse.ArgumentParser(description='RL')
     parser.add_argument('--algo', default='a2c',
                         help='algorithm to use: a2c | ppo | acktr')
@@ -31,18 +38,54 @@ def get_args():
                         help="sets flags for determinism when using CUDA (potentially slow!)")
     parser.add_argument('--num-processes', type=int, default=16,
                         help='how many training CPU processes to use (default: 16)')
+    parser.add_argument('--collect-threads', type=int, default=1,
+                        help='torch threads while collecting rollouts (default: 1)')
+    parser.add_argument('--update-threads', type=int, default=1,
+                        help='torch threads during the update, when the env workers are idle (default: 1)')
+    parser.add_argument('--learner-cores', default=None,
+                        help='pin the learner process to these cores, e.g. "0-3", split between the --num-learners (default: no pinning)')
+    parser.add_argument('--env-cores', default=None,
+                        help='pin the env worker processes to these cores, e.g. "4-15", split between the --num-learners (default: no pinning)')
+    parser.add_argument('--transition-cache-mb', type=float, default=None,
+                        help='memoize the transitions of deterministic envs with get_state/set_state, up to this many MB per env (default: None)')
+    parser.add_argument('--vec-env-backend', default=None, choices=['dummy', 'subproc'],
+                        help='run the envs in the main process or in subprocesses (default: subproc for more than one process)')
+    parser.add_argument('--config', default=None,
+                        help='JSON file of argument defaults, e.g. written by autotune.py; command line arguments take precedence')
+    parser.add_argument('--kfac-async-eig', action='store_true', default=False,
+                        help='compute the KFAC eigendecompositions on a background thread (acktr only)')
+    parser.add_argument('--kfac-low-rank', type=int, default=None,
+                        help='approximate KFAC factors larger than --kfac-low-rank-threshold by their top eigenpairs (acktr only, default: None)')
+    parser.add_argument('--kfac-low-rank-threshold', type=int, default=1024,
+                        help='size above which KFAC factors are approximated (default: 1024)')
+    parser.add_argument('--fisher-sample-fraction', type=float, default=1.0,
+                        help='fraction of the batch used for the ACKTR Fisher statistics (default: 1.0)')
+    parser.add_argument('--num-learners', type=int, default=1,
+                        help='how many data-parallel learner processes to use, each with its own envs (default: 1)')
+    parser.add_argument('--dist-port', type=int, default=29500,
+                        help='port used by the data-parallel learners to communicate (default: 29500)')
     parser.add_argument('--num-steps', type=int, default=5,
                         help='number of forward steps in A2C (default: 5)')
     parser.add_argument('--ppo-epoch', type=int, default=4,
                         help='number of ppo epochs (default: 4)')
     parser.add_argument('--num-mini-batch', type=int, default=32,
                         help='number of batches for ppo (default: 32)')
+    parser.add_argument('--microbatch-size', type=int, default=None,
+                        help='split each update batch into microbatches of this many samples and accumulate gradients (a2c/ppo only, at least --num-steps with a recurrent policy, default: None)')
     parser.add_argument('--clip-param', type=float, default=0.2,
                         help='ppo clip parameter (default: 0.2)')
+    parser.add_argument('--target-kl', type=float, default=None,
+                        help='stop the ppo update early once the approximate KL exceeds 1.5 * target-kl; '
+                             'the logged ppo_update_time_saved also counts the minibatch whose forward/backward '
+                             'pass tripped the check (default: None)')
     parser.add_argument('--log-interval', type=int, default=10,
                         help='log interval, one log per n updates (default: 10)')
     parser.add_argument('--save-interval', type=int, default=100,
                         help='save interval, one save per n updates (default: 100)')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='resume training from the latest checkpoint in save-dir')
+    parser.add_argument('--keep-checkpoints', type=int, default=3,
+                        help='number of most recent checkpoints to keep, at least 1 (default: 3)')
     parser.add_argument('--eval-interval', type=int, default=None,
                         help='eval interval, one eval per n updates (default: None)')
     parser.add_argument('--vis-interval', type=int, default=100,
@@ -67,6 +110,8 @@ def get_args():
                         help='use a linear schedule on the ppo clipping parameter')
     parser.add_argument('--vis', action='store_true', default=False,
                         help='enable visdom visualization')
+    parser.add_argument('--episode-log', action='store_true', default=False,
+                        help='with --vis, keep binary copies of the monitor logs that new plotting processes read instead of the CSVs')
     parser.add_argument('--port', type=int, default=8097,
                         help='port to run the server on (default: 8097)')
     parser.add_argument('--policy', type=str, default='default', choices=['default', 'VIN'],
@@ -81,9 +126,27 @@ def get_args():
                         help='intrinsic reward weight')
     parser.add_argument('--irsf', type=float, default=1.0,
                         help='intrinsic reward scaling factor')
+    parser.add_argument('--batch-intrinsic-reward', action='store_true', default=False,
+                        help='compute the curiosity reward once per rollout instead of at every step')
     parser.add_argument('--log-histograms', action='store_true', default=False,
                         help='store histograms of weights to tensorboard')
-    args = parser.parse_args()
+    parser.add_argument('--bf16', action='store_true', default=False,
+                        help='run the update forward/backward pass under bfloat16 autocast (a2c/ppo only)')
+    args = parser.parse_args(argv)
+
+    defaults = {}
+    if args.config is not None:
+        with open(args.config) as f:
+            defaults.update(json.load(f))
+    if config is not None:
+        defaults.update(config)
+    if defaults:
+        # set_defaults would silently add a misspelled key as a new attribute
+        unknown = set(defaults) - {a.dest for a in parser._actions}
+        if unknown:
+            raise ValueError('Unknown config keys: {}'.format(', '.join(sorted(unknown))))
+        parser.set_defaults(**defaults)
+        args = parser.parse_args(argv)
 
     args.cuda = not args.no_cuda and torch.cuda.is_available()
 
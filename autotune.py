@@ -0,0 +1,235 @@
+"""Pick the fastest --num-processes, --num-steps, --num-mini-batch and vec env
+backend for an environment and algorithm.
+
+Runs short calibration rollouts and updates for every candidate and writes
+the configuration with the most environment steps per second, among those
+that fit under the memory cap, as a JSON file for main.py --config:
+
+    python autotune.py --env-name "PongNoFrameskip-v4" --algo ppo \\
+        --tune-num-processes 4 8 16 --tune-num-steps 64 128 --output ppo_pong.json
+    python main.py --env-name "PongNoFrameskip-v4" --algo ppo --config ppo_pong.json
+
+All other arguments are those of main.py and are used as is.
+"""
+import argparse
+import json
+import os
+
+import torch
+
+import algo
+from arguments import get_args
+from envs import make_vec_envs
+from model import Policy
+from storage import RolloutStorage
+from threads import worker_pids
+from timing import PhaseTimer
+
+
+def get_tune_args():
+    parser = argparse.ArgumentParser(description='Autotune', add_help=False)
+    parser.add_argument('--tune-num-processes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--tune-num-steps', type=int, nargs='+', default=None,
+                        help='candidate rollout lengths (default: --num-steps only)')
+    parser.add_argument('--tune-num-mini-batch', type=int, nargs='+', default=None,
+                        help='candidate numbers of ppo minibatches (default: --num-mini-batch only)')
+    parser.add_argument('--tune-backends', nargs='+', default=['dummy', 'subproc'],
+                        choices=['dummy', 'subproc'])
+    parser.add_argument('--calibration-steps', type=int, default=50,
+                        help='env steps timed per backend and number of processes')
+    parser.add_argument('--update-repeats', type=int, default=3)
+    parser.add_argument('--memory-cap-mb', type=float, default=None,
+                        help='skip configurations whose peak memory exceeds this: the peak RSS of the '
+                             'learner and env worker processes during the trial (rollout storage on '
+                             'systems without /proc) plus the CUDA peak')
+    parser.add_argument('--output', default='autotune.json')
+    tune_args, rest = parser.parse_known_args()
+
+    # The remaining arguments are those of main.py
+    return tune_args, get_args(rest)
+
+
+def make_agent(args, actor_critic, num_mini_batch):
+    if args.algo == 'a2c':
+        return algo.A2C_ACKTR(actor_critic, args.value_loss_coef, args.entropy_coef,
+                              lr=args.lr, eps=args.eps, alpha=args.alpha,
+                              max_grad_norm=args.max_grad_norm)
+    elif args.algo == 'ppo':
+        return algo.PPO(actor_critic, args.clip_param, args.ppo_epoch, num_mini_batch,
+                        args.value_loss_coef, args.entropy_coef, lr=args.lr, eps=args.eps,
+                        max_grad_norm=args.max_grad_norm)
+    return algo.A2C_ACKTR(actor_critic, args.value_loss_coef, args.entropy_coef, acktr=True)
+
+
+def collect(actor_critic, envs, rollouts, num_steps, timer):
+    for step in range(num_steps):
+        with timer.phase('act'), torch.no_grad():
+            value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
+                rollouts.obs[step], rollouts.recurrent_hidden_states[step], rollouts.masks[step])
+
+        with timer.phase('env'):
+            obs, reward, done, infos = envs.step(action)
+
+        masks = torch.FloatTensor([[0.0] if done_ else [1.0] for done_ in done])
+        rollouts.insert(obs, recurrent_hidden_states, action, action_log_prob, value, reward, masks)
+
+
+def storage_mb(rollouts):
+    tensors = [rollouts.obs, rollouts.prev_obs, rollouts.recurrent_hidden_states, rollouts.rewards,
+               rollouts.value_preds, rollouts.returns, rollouts.action_log_probs, rollouts.actions,
+               rollouts.masks]
+    return sum(t.numel() * t.element_size() for t in tensors) / 2 ** 20
+
+
+def reset_peak_rss(pids):
+    """Reset the peak RSS (VmHWM) of processes, False without /proc support."""
+    try:
+        for pid in pids:
+            with open('/proc/{}/clear_refs'.format(pid), 'w') as f:
+                f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_mb(pids):
+    """Summed peak RSS of processes since reset_peak_rss.
+
+    Pages shared by forked workers count once per process, so this errs high.
+    """
+    total = 0
+    for pid in pids:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    total += int(line.split()[1])
+    return total / 2 ** 10
+
+
+def make_rollouts(args, envs, actor_critic, num_steps, device):
+    rollouts = RolloutStorage(num_steps, envs.num_envs, envs.observation_space.shape,
+                              envs.action_space, actor_critic.recurrent_hidden_state_size)
+    rollouts.obs[0].copy_(envs.reset())
+    rollouts.to(device)
+    return rollouts
+
+
+def calibrate_backend(args, tune_args, num_processes, backend, device):
+    """Seconds per step spent in the envs and in the policy."""
+    envs = make_vec_envs(args.env_name, args.seed, num_processes, args.gamma, None,
+                         args.add_timestep, device, False, backend=backend)
+    actor_critic = Policy(envs.observation_space.shape, envs.action_space,
+                          base_kwargs={'recurrent': args.recurrent_policy}).to(device)
+    rollouts = make_rollouts(args, envs, actor_critic, tune_args.calibration_steps, device)
+
+    timer = PhaseTimer()
+    collect(actor_critic, envs, rollouts, 5, timer)
+    rollouts.step = 0
+    timer.reset()
+    collect(actor_critic, envs, rollouts, tune_args.calibration_steps, timer)
+    envs.close()
+
+    phases = timer.summary()['phases']
+    return {name: phases[name]['time'] / tune_args.calibration_steps for name in ['env', 'act']}
+
+
+def time_updates(args, tune_args, envs, num_steps, num_mini_batch, device):
+    # The learner and env workers, measured from before this trial's storage exists
+    pids = [os.getpid()] + worker_pids(envs)
+    measure_rss = reset_peak_rss(pids)
+
+    actor_critic = Policy(envs.observation_space.shape, envs.action_space,
+                          base_kwargs={'recurrent': args.recurrent_policy}).to(device)
+    agent = make_agent(args, actor_critic, num_mini_batch)
+    rollouts = make_rollouts(args, envs, actor_critic, num_steps, device)
+    collect(actor_critic, envs, rollouts, num_steps, PhaseTimer())
+
+    if args.cuda:
+        torch.cuda.reset_peak_memory_stats()
+
+    timer = PhaseTimer()
+    agent.update(rollouts)
+    for _ in range(tune_args.update_repeats):
+        with timer.phase('returns'), torch.no_grad():
+            next_value = actor_critic.get_value(rollouts.obs[-1], rollouts.recurrent_hidden_states[-1],
+                                                rollouts.masks[-1])
+            rollouts.compute_returns(next_value, args.use_gae, args.gamma, args.tau)
+        with timer.phase('update'):
+            agent.update(rollouts)
+
+    phases = timer.summary()['phases']
+    memory_mb = peak_rss_mb(pids) if measure_rss else storage_mb(rollouts)
+    if args.cuda:
+        memory_mb += torch.cuda.max_memory_allocated() / 2 ** 20
+    return {'returns': phases['returns']['time'] / tune_args.update_repeats,
+            'update': phases['update']['time'] / tune_args.update_repeats,
+            'memory_mb': memory_mb}
+
+
+def main():
+    tune_args, args = get_tune_args()
+
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(1)
+    device = torch.device("cuda:0" if args.cuda else "cpu")
+
+    num_steps_candidates = tune_args.tune_num_steps or [args.num_steps]
+    num_mini_batch_candidates = [args.num_mini_batch]
+    if args.algo == 'ppo' and tune_args.tune_num_mini_batch is not None:
+        num_mini_batch_candidates = tune_args.tune_num_mini_batch
+
+    results = []
+    for num_processes in tune_args.tune_num_processes:
+        # The backend only changes the env step time
+        backends = {}
+        for backend in tune_args.tune_backends:
+            backends[backend] = calibrate_backend(args, tune_args, num_processes, backend, device)
+            print("{} processes, {}: {:.2e}s env, {:.2e}s act per step".format(
+                num_processes, backend, backends[backend]['env'], backends[backend]['act']))
+        backend = min(backends, key=lambda b: backends[b]['env'])
+        step_time = backends[backend]['env'] + backends[backend]['act']
+
+        envs = make_vec_envs(args.env_name, args.seed, num_processes, args.gamma, None,
+                             args.add_timestep, device, False, backend=backend)
+        for num_steps in num_steps_candidates:
+            for num_mini_batch in num_mini_batch_candidates:
+                if args.algo == 'ppo' and (num_processes * num_steps < num_mini_batch or
+                                           args.recurrent_policy and num_processes < num_mini_batch):
+                    continue
+
+                times = time_updates(args, tune_args, envs, num_steps, num_mini_batch, device)
+                iteration_time = num_steps * step_time + times['returns'] + times['update']
+                result = {
+                    'num_processes': num_processes,
+                    'num_steps': num_steps,
+                    'num_mini_batch': num_mini_batch,
+                    'vec_env_backend': backend,
+                    'fps': num_processes * num_steps / iteration_time,
+                    'env_fraction': num_steps * backends[backend]['env'] / iteration_time,
+                    'act_fraction': num_steps * backends[backend]['act'] / iteration_time,
+                    'update_fraction': (times['returns'] + times['update']) / iteration_time,
+                    'memory_mb': times['memory_mb'],
+                }
+                result['fits'] = tune_args.memory_cap_mb is None or \
+                    result['memory_mb'] <= tune_args.memory_cap_mb
+                print(json.dumps(result))
+                results.append(result)
+        envs.close()
+
+    candidates = [r for r in results if r['fits']]
+    if not candidates:
+        raise RuntimeError('No configuration fits under {} MB'.format(tune_args.memory_cap_mb))
+    best = max(candidates, key=lambda r: r['fps'])
+
+    config = {key: best[key] for key in ['num_processes', 'num_steps', 'vec_env_backend']}
+    if args.algo == 'ppo':
+        config['num_mini_batch'] = best['num_mini_batch']
+    with open(tune_args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    print("Best configuration ({:.0f} FPS) written to {}: {}".format(
+        best['fps'], tune_args.output, json.dumps(config)))
+
+
+if __name__ == "__main__":
+    main()
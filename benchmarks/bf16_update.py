@@ -0,0 +1,85 @@
+"""A/B benchmark of float32 versus bfloat16 autocast updates.
+
+Runs the same sequence of updates from the same initial weights in both modes,
+reports the time per update and checks that the loss curves stay within a
+relative tolerance of each other.
+
+    python benchmarks/bf16_update.py --algo ppo --num-updates 20
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from synthetic import (ATARI_OBS_SHAPE, make_action_space, make_policy,
+                       random_rollouts)
+
+import algo
+
+
+def run(args, use_bf16):
+    obs_shape = ATARI_OBS_SHAPE if args.image else (args.obs_size,)
+    action_space = make_action_space()
+    actor_critic = make_policy(obs_shape, action_space, seed=args.seed)
+    rollouts = random_rollouts(actor_critic, obs_shape, action_space,
+                               args.num_steps, args.num_processes, seed=args.seed)
+
+    if args.algo == 'ppo':
+        agent = algo.PPO(actor_critic, 0.2, args.ppo_epoch, args.num_mini_batch,
+                         0.5, 0.01, lr=2.5e-4, eps=1e-5, max_grad_norm=0.5,
+                         use_bf16=use_bf16)
+    else:
+        agent = algo.A2C_ACKTR(actor_critic, 0.5, 0.01, lr=7e-4, eps=1e-5,
+                               alpha=0.99, max_grad_norm=0.5, use_bf16=use_bf16)
+
+    torch.manual_seed(args.seed)
+    curve = []
+    times = []
+    for _ in range(args.num_updates):
+        start = time.time()
+        value_loss, action_loss, dist_entropy = agent.update(rollouts)
+        times.append(time.time() - start)
+        curve.append([value_loss, action_loss, dist_entropy])
+
+    # Skip the first update, it includes one-off allocation costs
+    return np.array(curve), np.median(times[1:] or times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bf16 update benchmark')
+    parser.add_argument('--algo', default='ppo', choices=['a2c', 'ppo'])
+    parser.add_argument('--num-steps', type=int, default=128)
+    parser.add_argument('--num-processes', type=int, default=8)
+    parser.add_argument('--ppo-epoch', type=int, default=4)
+    parser.add_argument('--num-mini-batch', type=int, default=4)
+    parser.add_argument('--num-updates', type=int, default=10)
+    parser.add_argument('--obs-size', type=int, default=64)
+    parser.add_argument('--no-image', dest='image', action='store_false', default=True,
+                        help='use an MLP policy on vector observations instead of CNNBase')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='max relative difference between loss curves (default: 0.1)')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+
+    fp32_curve, fp32_time = run(args, use_bf16=False)
+    bf16_curve, bf16_time = run(args, use_bf16=True)
+
+    scale = np.abs(fp32_curve).max(0) + 1e-8
+    rel_diff = (np.abs(bf16_curve - fp32_curve) / scale).max(0)
+
+    print("fp32: {:.4f}s/update, bf16: {:.4f}s/update, speedup {:.2f}x".format(
+        fp32_time, bf16_time, fp32_time / bf16_time))
+    print("max relative difference value/action/entropy: {:.4f}/{:.4f}/{:.4f}".format(
+        *rel_diff))
+
+    if (rel_diff > args.tolerance).any():
+        print("FAIL: bf16 loss curve outside tolerance {}".format(args.tolerance))
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Conv2d activation covariance in KFAC: chunked F.unfold versus full patches.
+
+Compares compute_cov_a against the previous implementation, which built the
+whole patch tensor, on the CNNBase conv layer shapes. The chunked version
+never holds more than COV_CHUNK_ELEMENTS patch elements at once (16MB in
+float32), the patches column is the size of the full patch tensor.
+
+    python benchmarks/kfac_cov.py --batch-size 80
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+import synthetic  # noqa: F401, sets up the import path
+
+from algo.kfac import compute_cov_a
+
+# (in_channels, height, width, kernel, stride) of the CNNBase conv layers
+CNN_BASE_LAYERS = [(4, 84, 84, 8, 4), (32, 20, 20, 4, 2), (64, 9, 9, 3, 1)]
+
+
+def _extract_patches(x, kernel_size, stride, padding):
+    if padding[0] + padding[1] > 0:
+        x = F.pad(x, (padding[1], padding[1], padding[0],
+                      padding[0])).data  # Actually check dims
+    x = x.unfold(2, kernel_size[0], stride[0])
+    x = x.unfold(3, kernel_size[1], stride[1])
+    x = x.transpose_(1, 2).transpose_(2, 3).contiguous()
+    x = x.view(
+        x.size(0), x.size(1), x.size(2),
+        x.size(3) * x.size(4) * x.size(5))
+    return x
+
+
+def reference_cov_a(a, layer_info, fast_cnn):
+    batch_size = a.size(0)
+    if fast_cnn:
+        a = _extract_patches(a, *layer_info)
+        a = a.view(a.size(0), -1, a.size(-1))
+        a = a.mean(1)
+    else:
+        a = _extract_patches(a, *layer_info)
+        a = a.view(-1, a.size(-1)).div_(a.size(1)).div_(a.size(2))
+    return a.t() @ (a / batch_size)
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.time()
+    for _ in range(repeats):
+        result = fn()
+    return (time.time() - start) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KFAC conv covariance benchmark')
+    parser.add_argument('--batch-size', type=int, default=80)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+
+    print("layer  fast_cnn  full(ms)  chunked(ms)  patches(MB)  max rel. diff")
+    for i, (c, h, w, k, s) in enumerate(CNN_BASE_LAYERS):
+        a = torch.rand(args.batch_size, c, h, w)
+        layer_info = ((k, k), (s, s), (0, 0))
+        out_h, out_w = (h - k) // s + 1, (w - k) // s + 1
+        patches_mb = args.batch_size * out_h * out_w * c * k * k * 4 / 2. ** 20
+
+        for fast_cnn in [False, True]:
+            full_time, full = timeit(
+                lambda: reference_cov_a(a.clone(), layer_info, fast_cnn), args.repeats)
+            chunked_time, chunked = timeit(
+                lambda: compute_cov_a(a, 'Conv2d', layer_info, fast_cnn), args.repeats)
+            diff = ((full - chunked).abs().max() / full.abs().max()).item()
+            print("{:5d}  {:8}  {:8.2f}  {:11.2f}  {:11.1f}  {:13.2e}".format(
+                i, str(fast_cnn), full_time * 1e3, chunked_time * 1e3, patches_mb, diff))
+
+
+if __name__ == "__main__":
+    main()
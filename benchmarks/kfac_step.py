@@ -0,0 +1,102 @@
+"""Time of an ACKTR update versus layer width, with exact and low-rank KFAC.
+
+The eigendecomposition runs on every step (Tf=1) so its cost dominates. The
+error columns are the relative error of the low-rank preconditioned
+gradient against the exact one, computed from the same factors: those
+accumulated from the rollouts, which have at most num_steps *
+num_processes nonzero eigenvalues and are exact at rank >= that, and
+full-rank factors of the same sizes and traces with a power-law spectrum
+(feature i scaled by i^-decay, --decay).
+
+    python benchmarks/kfac_step.py --hidden-sizes 64 256 1024 2048 --low-rank 128
+"""
+import argparse
+import time
+
+import torch
+
+from synthetic import make_action_space, make_policy, random_rollouts
+
+import algo
+from algo.kfac import compute_eigenbasis, precondition
+
+
+def time_updates(agent, rollouts, num_updates):
+    agent.update(rollouts)
+    start = time.time()
+    for _ in range(num_updates):
+        agent.update(rollouts)
+    return (time.time() - start) / num_updates
+
+
+def full_rank_factors(factors, decay):
+    """Full-rank SPD factors of the same sizes and traces as factors."""
+    result = {}
+    for m, f in factors.items():
+        n = f.size(0)
+        # 2n samples with feature scales i^-decay, so all n eigenvalues are nonzero
+        x = torch.randn(2 * n, n, dtype=f.dtype) * torch.arange(1, n + 1, dtype=f.dtype).pow(-decay)
+        full = x.t() @ x / (2 * n)
+        result[m] = full * (f.trace() / full.trace())
+    return result
+
+
+def precondition_error(optimizer, m_aa, m_gg, low_rank, low_rank_threshold):
+    exact = compute_eigenbasis(m_aa, m_gg)
+    approx = compute_eigenbasis(m_aa, m_gg, low_rank, low_rank_threshold)
+
+    la = optimizer.damping + optimizer.weight_decay
+    num, den = 0., 0.
+    for m in optimizer.modules:
+        p = next(m.parameters())
+        grad = torch.randn(p.size(0), p[0].numel())
+        vs = []
+        for d_a, Q_a, sigma_a, d_g, Q_g, sigma_g in [exact, approx]:
+            vs.append(precondition(grad, d_g[m], Q_g[m], sigma_g[m],
+                                   d_a[m], Q_a[m], sigma_a[m], la))
+        num += (vs[0] - vs[1]).pow(2).sum().item()
+        den += vs[0].pow(2).sum().item()
+    return (num / den) ** 0.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KFAC step benchmark')
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--obs-size', type=int, default=64)
+    parser.add_argument('--num-steps', type=int, default=5)
+    parser.add_argument('--num-processes', type=int, default=16)
+    parser.add_argument('--num-updates', type=int, default=5)
+    parser.add_argument('--low-rank', type=int, default=128)
+    parser.add_argument('--low-rank-threshold', type=int, default=256)
+    parser.add_argument('--decay', type=float, default=0.5,
+                        help='feature scale exponent of the full-rank factors (default: 0.5)')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+
+    obs_shape = (args.obs_size,)
+    action_space = make_action_space()
+
+    print("hidden  exact(s)  low-rank(s)  error(rollout)  error(full-rank)")
+    for hidden_size in args.hidden_sizes:
+        times = []
+        for low_rank in [None, args.low_rank]:
+            actor_critic = make_policy(obs_shape, action_space, hidden_size=hidden_size)
+            rollouts = random_rollouts(actor_critic, obs_shape, action_space,
+                                       args.num_steps, args.num_processes)
+            agent = algo.A2C_ACKTR(actor_critic, 0.5, 0.01, acktr=True, kfac_kwargs={
+                'Tf': 1, 'low_rank': low_rank, 'low_rank_threshold': args.low_rank_threshold})
+            times.append(time_updates(agent, rollouts, args.num_updates))
+
+        optimizer = agent.optimizer
+        error = precondition_error(optimizer, optimizer.m_aa, optimizer.m_gg,
+                                   args.low_rank, args.low_rank_threshold)
+        full_rank_error = precondition_error(optimizer, full_rank_factors(optimizer.m_aa, args.decay),
+                                             full_rank_factors(optimizer.m_gg, args.decay),
+                                             args.low_rank, args.low_rank_threshold)
+        print("{:6d}  {:8.4f}  {:11.4f}  {:14.2e}  {:16.2e}".format(
+            hidden_size, times[0], times[1], error, full_rank_error))
+
+
+if __name__ == "__main__":
+    main()
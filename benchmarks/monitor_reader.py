@@ -0,0 +1,121 @@
+"""Compares visualize.load_data to the previous line-by-line version.
+
+Writes --num-files synthetic monitor CSVs with --num-episodes episodes in
+total and checks that the curves of the old and new load_data match. It
+then times a full parse, reading --append-fraction new episodes
+incrementally, and a cold start from the binary episode log.
+
+    python benchmarks/monitor_reader.py --num-episodes 1000000 --num-files 16
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic  # noqa: F401, puts the repository on the path
+import visualize
+from visualize import MonitorReader, load_data, smooth_reward_curve
+
+
+def fix_point_loop(x, y, interval):
+    # The Python loop load_data used before
+    fx, fy = [], []
+    pointer = 0
+    ninterval = int(max(x) / interval + 1)
+    for i in range(ninterval):
+        tmpx = interval * i
+        while pointer + 1 < len(x) and tmpx > x[pointer + 1]:
+            pointer += 1
+        if pointer + 1 < len(x):
+            alpha = (y[pointer + 1] - y[pointer]) / (x[pointer + 1] - x[pointer])
+            fx.append(tmpx)
+            fy.append(y[pointer] + alpha * (tmpx - x[pointer]))
+    return fx, fy
+
+
+def load_data_loop(indir, bin_size):
+    datas = []
+    for name in sorted(os.listdir(indir)):
+        if not name.endswith('.monitor.csv'):
+            continue
+        with open(os.path.join(indir, name)) as f:
+            f.readline()
+            f.readline()
+            for line in f:
+                tmp = line.split(',')
+                datas.append([float(tmp[2]), int(tmp[1]), float(tmp[0])])
+    datas = sorted(datas, key=lambda d: d[0])
+    result, timesteps = [], 0
+    for d in datas:
+        result.append([timesteps, d[-1]])
+        timesteps += d[1]
+    x, y = np.array(result)[:, 0], np.array(result)[:, 1]
+    x, y = smooth_reward_curve(x, y)
+    return fix_point_loop(x, y, bin_size)
+
+
+def write_monitors(indir, num_files, num_episodes, rng, start=0):
+    """Append num_episodes episodes spread over the files, episodes end at increasing times."""
+    per_file = num_episodes // num_files
+    for i in range(num_files):
+        path = os.path.join(indir, '{}.monitor.csv'.format(i))
+        new = not os.path.exists(path)
+        with open(path, 'a') as f:
+            if new:
+                f.write('#' + json.dumps({'t_start': 1000.0}) + '\n')
+                f.write('r,l,t\n')
+            lengths = rng.randint(10, 500, per_file)
+            rewards = np.round(rng.randn(per_file) * 10, 6)
+            times = np.round(start + np.cumsum(rng.uniform(0.01, 1, per_file)) + i * 1e-3, 6)
+            f.write(''.join('{},{},{}\n'.format(r, l, t) for r, l, t in zip(rewards, lengths, times)))
+    return start + per_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor log reader')
+    parser.add_argument('--num-episodes', type=int, default=200000)
+    parser.add_argument('--num-files', type=int, default=8)
+    parser.add_argument('--append-fraction', type=float, default=0.01)
+    parser.add_argument('--bin-size', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    indir = tempfile.mkdtemp()
+    try:
+        end = write_monitors(indir, args.num_files, args.num_episodes, rng)
+
+        start = time.perf_counter()
+        old_x, old_y = load_data_loop(indir, args.bin_size)
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        x, y = load_data(indir, 1, args.bin_size, episode_log=True)
+        full_time = time.perf_counter() - start
+        print("full parse: {:.3f}s old, {:.3f}s new; max curve difference {:.2e} over {} points".format(
+            old_time, full_time, np.abs(np.array(old_y) - y).max(), len(x)))
+        assert len(x) == len(old_x)
+
+        write_monitors(indir, args.num_files, int(args.num_episodes * args.append_fraction), rng, start=end)
+        start = time.perf_counter()
+        x, y = load_data(indir, 1, args.bin_size, episode_log=True)
+        append_time = time.perf_counter() - start
+        old_x, old_y = load_data_loop(indir, args.bin_size)
+        print("after appending {:.0%}: {:.3f}s; max curve difference {:.2e}".format(
+            args.append_fraction, append_time, np.abs(np.array(old_y) - y).max()))
+
+        parsed = visualize._readers.pop(indir).episodes
+        start = time.perf_counter()
+        episodes = MonitorReader(indir, episode_log=True).read()
+        print("cold start from the episode log: {:.3f}s for {} episodes".format(
+            time.perf_counter() - start, len(episodes)))
+        assert np.array_equal(episodes, parsed)
+    finally:
+        shutil.rmtree(indir)
+
+
+if __name__ == "__main__":
+    main()
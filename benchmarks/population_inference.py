@@ -0,0 +1,62 @@
+"""Compare P separate `Policy.act` calls with one batched `PolicyPopulation.act`.
+
+    python benchmarks/population_inference.py --population-size 16
+"""
+import argparse
+import time
+
+import torch
+
+from synthetic import ATARI_OBS_SHAPE, make_action_space, make_policy
+
+from model import PolicyPopulation
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.time()
+    for _ in range(repeats):
+        fn()
+    return (time.time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='population inference benchmark')
+    parser.add_argument('--population-size', type=int, default=16)
+    parser.add_argument('--num-processes', type=int, default=8)
+    parser.add_argument('--obs-size', type=int, default=64)
+    parser.add_argument('--image', action='store_true', default=False,
+                        help='use CNNBase on 84x84 observations')
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+
+    obs_shape = ATARI_OBS_SHAPE if args.image else (args.obs_size,)
+    action_space = make_action_space()
+    policies = [make_policy(obs_shape, action_space, seed=i)
+                for i in range(args.population_size)]
+    population = PolicyPopulation(policies)
+
+    P, N = args.population_size, args.num_processes
+    obs = torch.randn(P, N, *obs_shape)
+    rnn_hxs = torch.zeros(P, N, population.recurrent_hidden_state_size)
+    masks = torch.ones(P, N, 1)
+
+    def separate():
+        with torch.no_grad():
+            for i, policy in enumerate(policies):
+                policy.act(obs[i], rnn_hxs[i], masks[i])
+
+    def batched():
+        with torch.no_grad():
+            population.act(obs, rnn_hxs, masks)
+
+    separate_time = timeit(separate, args.repeats)
+    batched_time = timeit(batched, args.repeats)
+    print("P={} separate: {:.2f}ms, batched: {:.2f}ms, speedup {:.2f}x".format(
+        P, separate_time * 1e3, batched_time * 1e3, separate_time / batched_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Cold-start times of the CLI and of an env worker, in fresh interpreters.
+
+"main" imports main.py and parses and checks its arguments (no
+training), "enjoy" does the imports of enjoy.py and
+"worker" builds one env the way a spawned SubprocVecEnv worker does. For
+each the median wall time is printed with the heavy modules it loaded.
+
+    python benchmarks/startup.py --env-name CartPole-v1 --repeats 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['torch', 'tensorboardX', 'matplotlib', 'scipy', 'rl_algos', 'gym_ple',
+                 'gym_nv_ple', 'gridworlds', 'roboschool', 'pybullet_envs', 'dm_control2gym']
+
+REPORT = '''
+import json, sys
+print(json.dumps([m for m in {} if m in sys.modules]))
+'''.format(HEAVY_MODULES)
+
+
+def scripts(env_name):
+    return {
+        'main': "import main; main.check_args(main.get_args(['--env-name', {!r}]))".format(env_name),
+        'enjoy': "import checkpoint, envs, utils",
+        'worker': "import worker_envs; worker_envs.make_env({!r}, 0, 0, None, False, False)()".format(
+            env_name),
+    }
+
+
+def cold_start(script, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script + REPORT],
+                                         cwd=REPO)
+        times.append(time.perf_counter() - start)
+    modules = json.loads(output.decode().strip().splitlines()[-1])
+    return sorted(times)[len(times) // 2], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time')
+    parser.add_argument('--env-name', default='CartPole-v1')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', nargs='+', default=None, choices=['main', 'enjoy', 'worker'])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'pass'])
+    print("interpreter: {:.3f}s".format(time.perf_counter() - start))
+
+    for name, script in scripts(args.env_name).items():
+        if args.only is not None and name not in args.only:
+            continue
+        seconds, modules = cold_start(script, args.repeats)
+        print("{}: {:.3f}s, loaded {}".format(name, seconds, ', '.join(modules) or 'nothing heavy'))
+
+
+if __name__ == "__main__":
+    main()
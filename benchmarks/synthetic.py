@@ -0,0 +1,61 @@
+"""Helpers for benchmarks that do not need a real environment."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from gym.spaces import Box, Discrete
+
+from model import Policy
+from storage import RolloutStorage
+
+ATARI_OBS_SHAPE = (4, 84, 84)
+
+
+def make_policy(obs_shape, action_space, recurrent=False, hidden_size=None, seed=0):
+    torch.manual_seed(seed)
+    base_kwargs = {'recurrent': recurrent}
+    if hidden_size is not None:
+        base_kwargs['hidden_size'] = hidden_size
+    return Policy(obs_shape, action_space, base_kwargs=base_kwargs)
+
+
+def make_action_space(discrete=True, num_actions=6):
+    if discrete:
+        return Discrete(num_actions)
+    return Box(-1.0, 1.0, (num_actions,))
+
+
+def random_rollouts(actor_critic, obs_shape, action_space, num_steps, num_processes, seed=0):
+    """Fill a RolloutStorage with random observations and consistent policy outputs."""
+    torch.manual_seed(seed)
+    rollouts = RolloutStorage(num_steps, num_processes, obs_shape, action_space,
+                              actor_critic.recurrent_hidden_state_size)
+
+    if len(obs_shape) == 3:
+        rollouts.obs.random_(0, 256)
+    else:
+        rollouts.obs.normal_()
+    rollouts.prev_obs[1:].copy_(rollouts.obs[:-1])
+
+    if action_space.__class__.__name__ == 'Discrete':
+        rollouts.actions.random_(0, action_space.n)
+    else:
+        rollouts.actions.normal_()
+
+    rollouts.rewards.normal_()
+    rollouts.masks[1:].bernoulli_(0.99)
+
+    with torch.no_grad():
+        obs_shape = rollouts.obs.size()[2:]
+        values, action_log_probs, _, _ = actor_critic.evaluate_actions(
+            rollouts.obs[:-1].view(-1, *obs_shape),
+            rollouts.recurrent_hidden_states[0].view(-1, actor_critic.recurrent_hidden_state_size),
+            rollouts.masks[:-1].view(-1, 1),
+            rollouts.actions.view(-1, rollouts.actions.size(-1)))
+        rollouts.value_preds[:-1].copy_(values.view(num_steps, num_processes, 1))
+        rollouts.action_log_probs.copy_(action_log_probs.view(num_steps, num_processes, 1))
+
+    rollouts.compute_returns(rollouts.value_preds[-2], True, 0.99, 0.95)
+    return rollouts
@@ -0,0 +1,208 @@
+"""Deterministic synthetic environments and vector envs for benchmarks.
+
+They need neither ROMs nor baselines: the vector envs implement the
+reset/step_async/step_wait interface of baselines' VecEnv and TorchVecEnv
+converts to tensors like envs.VecPyTorch.
+"""
+import multiprocessing as mp
+import time
+
+import gym
+import numpy as np
+import torch
+from gym.spaces import Box, Discrete
+
+
+def _spin(seconds):
+    # Busy wait, a sleeping env would not compete for the CPU like a real one
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class VectorObsEnv(gym.Env):
+    """Linear dynamics on a vector observation, episodes of fixed length."""
+    def __init__(self, obs_size=64, num_actions=6, episode_length=200, step_cost=0., seed=0):
+        self.observation_space = Box(-np.inf, np.inf, (obs_size,), dtype=np.float32)
+        self.action_space = Discrete(num_actions)
+        self.episode_length = episode_length
+        self.step_cost = step_cost
+
+        rng = np.random.RandomState(seed)
+        self.dynamics = rng.normal(0, 1. / np.sqrt(obs_size), (obs_size, obs_size)).astype(np.float32)
+        self.action_effects = rng.normal(0, 0.1, (num_actions, obs_size)).astype(np.float32)
+        self.initial_state = rng.normal(0, 1, obs_size).astype(np.float32)
+
+    def reset(self):
+        self.t = 0
+        self.state = self.initial_state.copy()
+        return self.state.copy()
+
+    def step(self, action):
+        _spin(self.step_cost)
+        self.t += 1
+        self.state = np.tanh(self.dynamics @ self.state + self.action_effects[int(action)])
+        reward = float(self.state[0])
+        return self.state.copy(), reward, self.t >= self.episode_length, {}
+
+
+class ImageObsEnv(gym.Env):
+    """Stacked 84x84 uint8 frames of a square moving over a fixed textured
+    background, like the output of the Atari pipeline."""
+    def __init__(self, num_stack=4, num_actions=6, episode_length=200, step_cost=0., seed=0):
+        self.observation_space = Box(0, 255, (num_stack, 84, 84), dtype=np.uint8)
+        self.action_space = Discrete(num_actions)
+        self.episode_length = episode_length
+        self.step_cost = step_cost
+        rng = np.random.RandomState(seed)
+        self.initial_position = rng.randint(0, 76, 2)
+        self.background = rng.randint(0, 128, (84, 84)).astype(np.uint8)
+
+    def reset(self):
+        self.t = 0
+        self.position = self.initial_position.copy()
+        self.frames = np.zeros(self.observation_space.shape, dtype=np.uint8)
+        self._render()
+        return self.frames.copy()
+
+    def _render(self):
+        self.frames[:-1] = self.frames[1:]
+        self.frames[-1] = self.background
+        y, x = self.position
+        self.frames[-1, y:y + 8, x:x + 8] = 255
+
+    def step(self, action):
+        _spin(self.step_cost)
+        self.t += 1
+        move = np.array([[0, 0], [-1, 0], [1, 0], [0, -1], [0, 1], [1, 1]])[int(action) % 6]
+        self.position = np.clip(self.position + 4 * move, 0, 76)
+        self._render()
+        reward = float(self.position[0] == 76)
+        return self.frames.copy(), reward, self.t >= self.episode_length, {}
+
+
+def _step_reset(env, action):
+    obs, reward, done, info = env.step(action)
+    if done:
+        obs = env.reset()
+    return obs, reward, done, info
+
+
+class SerialVecEnv(object):
+    """Steps all envs in the calling process, like DummyVecEnv."""
+    def __init__(self, env_fns):
+        self.envs = [fn() for fn in env_fns]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    def reset(self):
+        return np.stack([env.reset() for env in self.envs])
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        results = [_step_reset(env, a) for env, a in zip(self.envs, self.actions)]
+        obs, rewards, dones, infos = zip(*results)
+        return np.stack(obs), np.array(rewards, dtype=np.float32), np.array(dones), infos
+
+    def close(self):
+        pass
+
+
+def _worker(remote, env_fn):
+    env = env_fn()
+    while True:
+        cmd, data = remote.recv()
+        if cmd == 'step':
+            remote.send(_step_reset(env, data))
+        elif cmd == 'reset':
+            remote.send(env.reset())
+        else:
+            remote.close()
+            break
+
+
+class ProcessVecEnv(SerialVecEnv):
+    """Steps every env in its own process, like SubprocVecEnv."""
+    def __init__(self, env_fns):
+        env = env_fns[0]()
+        self.num_envs = len(env_fns)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+
+        self.remotes, work_remotes = zip(*[mp.Pipe() for _ in env_fns])
+        self.processes = [mp.Process(target=_worker, args=(work_remote, fn), daemon=True)
+                          for work_remote, fn in zip(work_remotes, env_fns)]
+        for p in self.processes:
+            p.start()
+        for work_remote in work_remotes:
+            work_remote.close()
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        return np.stack([remote.recv() for remote in self.remotes])
+
+    def step_async(self, actions):
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', action))
+
+    def step_wait(self):
+        obs, rewards, dones, infos = zip(*[remote.recv() for remote in self.remotes])
+        return np.stack(obs), np.array(rewards, dtype=np.float32), np.array(dones), infos
+
+    def close(self):
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.processes:
+            p.join()
+
+
+class TorchVecEnv(object):
+    """Tensor observations and rewards, like envs.VecPyTorch."""
+    def __init__(self, venv, device='cpu'):
+        self.venv = venv
+        self.device = device
+        self.num_envs = venv.num_envs
+        self.observation_space = venv.observation_space
+        self.action_space = venv.action_space
+
+    def reset(self):
+        return torch.from_numpy(self.venv.reset()).float().to(self.device)
+
+    def step_async(self, actions):
+        self.venv.step_async(actions.squeeze(1).cpu().numpy())
+
+    def step_wait(self):
+        obs, reward, done, info = self.venv.step_wait()
+        obs = torch.from_numpy(obs).float().to(self.device)
+        reward = torch.from_numpy(reward).unsqueeze(dim=1).float()
+        return obs, reward, done, info
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        self.venv.close()
+
+
+class _EnvFn(object):
+    # Picklable env constructor for the worker processes
+    def __init__(self, env_class, seed, kwargs):
+        self.env_class, self.seed, self.kwargs = env_class, seed, kwargs
+
+    def __call__(self):
+        return self.env_class(seed=self.seed, **self.kwargs)
+
+
+def make_synthetic_vec_env(kind, num_processes, step_cost=0., backend='serial', seed=0,
+                           device='cpu', **env_kwargs):
+    """Vector env of num_processes 'vector' or 'image' envs on a 'serial' or 'process' backend."""
+    env_class = {'vector': VectorObsEnv, 'image': ImageObsEnv}[kind]
+    env_kwargs['step_cost'] = step_cost
+    env_fns = [_EnvFn(env_class, seed + rank, env_kwargs) for rank in range(num_processes)]
+    venv_class = {'serial': SerialVecEnv, 'process': ProcessVecEnv}[backend]
+    return TorchVecEnv(venv_class(env_fns), device)
@@ -0,0 +1,132 @@
+"""Checks the tensorized envs against their gym versions and compares speed.
+
+CartPole: random states and actions are stepped by both implementations
+(the tensor env in float64) and the largest state difference and any
+termination mismatch are reported. FrozenLake: every (cell, action)
+transition out of a non-terminal cell is compared. Then the steps per
+second of the tensor env with --num-envs envs are compared to stepping gym
+envs one by one. Exits with 1 if either env differs from gym.
+
+    python benchmarks/tensor_env_parity.py --num-envs 4096
+"""
+import argparse
+import time
+
+import gym
+import numpy as np
+import torch
+
+import synthetic  # noqa: F401, puts the repository on the path
+from tensor_envs import CartPoleTensorEnv, FrozenLakeTensorEnv
+
+
+def gym_step(env, action):
+    # gym >= 0.26 returns (obs, reward, terminated, truncated, info)
+    result = env.step(action)
+    return result[0], result[1], result[2]
+
+
+def cartpole_parity(num_states, seed):
+    rng = np.random.RandomState(seed)
+    states = rng.uniform(-0.2, 0.2, (num_states, 4))
+    actions = rng.randint(0, 2, num_states)
+
+    env = gym.make('CartPole-v1').unwrapped
+    env.reset(seed=seed)
+    expected_states, expected_dones = [], []
+    for state, action in zip(states, actions):
+        env.state = state.copy()
+        obs, _, done = gym_step(env, int(action))
+        expected_states.append(env.state)
+        expected_dones.append(done)
+
+    tensor_env = CartPoleTensorEnv(num_states, dtype=torch.float64, seed=seed)
+    tensor_env.reset()
+    tensor_env.state = torch.from_numpy(states)
+    _, terminated = tensor_env._step(torch.from_numpy(actions))
+
+    state_error = np.abs(tensor_env.state.numpy() - np.array(expected_states, dtype=np.float64)).max()
+    done_mismatches = int((terminated.numpy() != np.array(expected_dones)).sum())
+    return state_error, done_mismatches
+
+
+def frozen_lake_parity(map_name):
+    env = gym.make('FrozenLake-v1', map_name=map_name, is_slippery=False).unwrapped
+    # Terminal cells are reset before they are stepped from
+    desc = ''.join(FrozenLakeTensorEnv.maps[map_name])
+    start_cells = [i for i, c in enumerate(desc) if c not in 'HG']
+    tensor_env = FrozenLakeTensorEnv(len(start_cells) * 4, map_name=map_name)
+    tensor_env.reset()
+
+    cells = np.repeat(start_cells, 4)
+    actions = np.tile(np.arange(4), len(start_cells))
+    tensor_env.position = torch.from_numpy(cells)
+    reward, terminated = tensor_env._step(torch.from_numpy(actions))
+
+    mismatches = 0
+    for i, (cell, action) in enumerate(zip(cells, actions)):
+        env.reset()
+        env.s = int(cell)
+        obs, r, done = gym_step(env, int(action))
+        mismatches += int(obs != tensor_env.position[i].item() or r != reward[i].item() or
+                          done != terminated[i].item())
+    return mismatches
+
+
+def steps_per_second(num_envs, num_steps, seed):
+    tensor_env = CartPoleTensorEnv(num_envs, seed=seed)
+    tensor_env.reset()
+    actions = torch.randint(0, 2, (num_steps, num_envs, 1))
+    start = time.perf_counter()
+    for t in range(num_steps):
+        tensor_env.step(actions[t])
+    tensor_fps = num_envs * num_steps / (time.perf_counter() - start)
+
+    envs = [gym.make('CartPole-v1').unwrapped for _ in range(min(num_envs, 64))]
+    for env in envs:
+        env.reset(seed=seed)
+    start = time.perf_counter()
+    for t in range(num_steps):
+        for i, env in enumerate(envs):
+            _, _, done = gym_step(env, int(actions[t, i]))
+            if done:
+                env.reset()
+    gym_fps = len(envs) * num_steps / (time.perf_counter() - start)
+    return tensor_fps, gym_fps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tensor env parity and speed')
+    parser.add_argument('--num-states', type=int, default=10000)
+    parser.add_argument('--num-envs', type=int, default=4096)
+    parser.add_argument('--num-steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='max CartPole state difference (default: 1e-6)')
+    args = parser.parse_args()
+
+    failed = False
+    state_error, done_mismatches = cartpole_parity(args.num_states, args.seed)
+    print("CartPole-v1: max state error {:.2e}, {} termination mismatches".format(
+        state_error, done_mismatches))
+    if state_error > args.tolerance or done_mismatches:
+        print("FAIL: CartPole-v1 differs from gym")
+        failed = True
+    for map_name in ['4x4', '8x8']:
+        mismatches = frozen_lake_parity(map_name)
+        print("FrozenLake {}: {} transition mismatches".format(map_name, mismatches))
+        if mismatches:
+            print("FAIL: FrozenLake {} differs from gym".format(map_name))
+            failed = True
+
+    tensor_fps, gym_fps = steps_per_second(args.num_envs, args.num_steps, args.seed)
+    print("CartPole-v1 steps/s: {:.0f} tensor ({} envs), {:.0f} gym".format(
+        tensor_fps, args.num_envs, gym_fps))
+
+    if failed:
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
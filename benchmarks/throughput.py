@@ -0,0 +1,185 @@
+"""Throughput suite on synthetic environments, results as JSON.
+
+For every combination of env kind, num_processes, num_steps and recurrent
+policy it measures the rollout FPS (act, env step and insert like main.py),
+compute_returns, minibatch generation and the PPO, A2C and ACKTR update
+times. The ACKTR rows also report the time of one KFAC
+eigendecomposition. Compare the JSON files of two commits to spot
+regressions.
+
+    python benchmarks/throughput.py --envs vector image --num-processes 1 8 \\
+        --num-steps 5 128 --output throughput.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+import torch
+
+from synthetic import make_policy
+from synthetic_envs import make_synthetic_vec_env
+
+import algo
+from storage import RolloutStorage
+from timing import timer
+
+
+def collect(actor_critic, envs, rollouts, num_steps):
+    for step in range(num_steps):
+        with torch.no_grad():
+            value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
+                rollouts.obs[step], rollouts.recurrent_hidden_states[step], rollouts.masks[step])
+
+        obs, reward, done, infos = envs.step(action)
+
+        masks = torch.FloatTensor([[0.0] if done_ else [1.0] for done_ in done])
+        rollouts.insert(obs, recurrent_hidden_states, action, action_log_prob, value, reward, masks)
+
+
+def time_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def make_agent(name, actor_critic, args):
+    if name == 'ppo':
+        return algo.PPO(actor_critic, 0.2, args.ppo_epoch, args.num_mini_batch, 0.5, 0.01,
+                        lr=2.5e-4, eps=1e-5, max_grad_norm=0.5)
+    if name == 'a2c':
+        return algo.A2C_ACKTR(actor_critic, 0.5, 0.01, lr=7e-4, eps=1e-5, alpha=0.99,
+                              max_grad_norm=0.5)
+    return algo.A2C_ACKTR(actor_critic, 0.5, 0.01, acktr=True)
+
+
+def run(args, kind, num_processes, num_steps, recurrent):
+    envs = make_synthetic_vec_env(kind, num_processes, step_cost=args.step_cost,
+                                  backend=args.backend, seed=args.seed)
+    obs_shape = envs.observation_space.shape
+    result = {'env': kind, 'num_processes': num_processes, 'num_steps': num_steps,
+              'recurrent': recurrent}
+
+    actor_critic = make_policy(obs_shape, envs.action_space, recurrent=recurrent, seed=args.seed)
+    rollouts = RolloutStorage(num_steps, num_processes, obs_shape, envs.action_space,
+                              actor_critic.recurrent_hidden_state_size)
+    rollouts.obs[0].copy_(envs.reset())
+
+    def rollout():
+        collect(actor_critic, envs, rollouts, num_steps)
+        rollouts.after_update()
+
+    rollout_time = time_call(rollout, args.repeats)
+    envs.close()
+    result['rollout_fps'] = num_steps * num_processes / rollout_time
+
+    with torch.no_grad():
+        next_value = actor_critic.get_value(rollouts.obs[-1], rollouts.recurrent_hidden_states[-1],
+                                            rollouts.masks[-1])
+    result['compute_returns_s'] = time_call(
+        lambda: rollouts.compute_returns(next_value, True, 0.99, 0.95), args.repeats)
+
+    advantages = rollouts.returns[:-1] - rollouts.value_preds[:-1]
+    num_mini_batch = min(args.num_mini_batch, num_processes) if recurrent else args.num_mini_batch
+
+    def minibatches():
+        if recurrent:
+            generator = rollouts.recurrent_generator(advantages, num_mini_batch)
+        else:
+            generator = rollouts.feed_forward_generator(advantages, num_mini_batch)
+        for _ in generator:
+            pass
+
+    result['minibatch_generation_s'] = time_call(minibatches, args.repeats)
+
+    for name in args.algos:
+        if name == 'acktr' and recurrent:
+            continue
+        if name == 'ppo' and recurrent and num_processes < args.num_mini_batch:
+            continue
+        agent_policy = make_policy(obs_shape, envs.action_space, recurrent=recurrent, seed=args.seed)
+        agent = make_agent(name, agent_policy, args)
+
+        # A failing algorithm is recorded and the others are still timed
+        try:
+            timer.reset()
+            agent.update(rollouts)
+            result[name + '_update_s'] = time_call(lambda: agent.update(rollouts), args.repeats)
+            if name == 'acktr':
+                # Time per eigendecomposition, they only run every Tf updates
+                eig = timer.summary()['phases']['update/kfac_eig']
+                result['acktr_kfac_eig_s'] = eig['time'] / eig['count']
+        except Exception as e:
+            traceback.print_exc()
+            result[name + '_error'] = repr(e)
+
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput benchmark suite')
+    parser.add_argument('--envs', nargs='+', default=['vector', 'image'], choices=['vector', 'image'])
+    parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--num-steps', type=int, nargs='+', default=[5, 128])
+    parser.add_argument('--recurrent', type=int, nargs='+', default=[0, 1],
+                        help='1 for recurrent policies, 0 for feed forward ones')
+    parser.add_argument('--algos', nargs='+', default=['ppo', 'a2c', 'acktr'],
+                        choices=['ppo', 'a2c', 'acktr'])
+    parser.add_argument('--backend', default='serial', choices=['serial', 'process'])
+    parser.add_argument('--step-cost', type=float, default=0.,
+                        help='seconds of CPU time per env step')
+    parser.add_argument('--ppo-epoch', type=int, default=4)
+    parser.add_argument('--num-mini-batch', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='JSON file (default: stdout)')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+
+    results = []
+    for kind, num_processes, num_steps, recurrent in itertools.product(
+            args.envs, args.num_processes, args.num_steps, args.recurrent):
+        try:
+            result = run(args, kind, num_processes, num_steps, bool(recurrent))
+        except Exception as e:
+            # Keep going, the row records the error
+            traceback.print_exc()
+            result = {'env': kind, 'num_processes': num_processes, 'num_steps': num_steps,
+                      'recurrent': bool(recurrent), 'error': repr(e)}
+        print(json.dumps(result), file=sys.stderr, flush=True)
+        results.append(result)
+
+    report = {
+        'commit': git_commit(),
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import copy
+import glob
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+
+from model import Policy
+from utils import split_bias
+
+
+def snapshot(obj):
+    """Copy the tensors of a (nested) state dict so training can go on mutating them."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+class CheckpointWriter(object):
+    """Writes checkpoints on a background thread.
+
+    `save` only snapshots the given state dicts on the calling thread.
+    Serialization happens off-thread into a temporary file that is atomically
+    renamed to `<name>-<update>.pt`, `<name>.pt` is then atomically pointed at
+    the newest checkpoint and only the last `keep` numbered checkpoints are
+    kept. A crash mid-write never leaves a truncated checkpoint behind.
+    """
+    def __init__(self, save_path, name, keep=3):
+        self.save_path = save_path
+        self.name = name
+        self.keep = keep
+
+        try:
+            os.makedirs(save_path)
+        except OSError:
+            pass
+
+        self._job = None
+        self._error = None
+        self._thread = None
+
+    def save(self, state, update):
+        """Snapshot state (a dict of state dicts) and write it in the background."""
+        state = snapshot(state)
+        self.wait()
+        self._job = (state, update)
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """Block until the last checkpoint is on disk, re-raising its error."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        self.wait()
+
+    def _path(self, suffix=''):
+        return os.path.join(self.save_path, self.name + suffix + '.pt')
+
+    def _write(self):
+        state, update = self._job
+        try:
+            path = self._path('-{}'.format(update))
+            _atomic_save(state, path)
+
+            # Point <name>.pt at the newest checkpoint without writing it twice
+            latest_tmp = self._path('.tmp-latest')
+            try:
+                os.link(path, latest_tmp)
+            except OSError:
+                _atomic_save(state, self._path())
+            else:
+                os.replace(latest_tmp, self._path())
+
+            for old in self._checkpoints()[:-self.keep]:
+                os.remove(old)
+        except Exception as e:
+            self._error = e
+
+    def _checkpoints(self):
+        paths = glob.glob(self._path('-*'))
+        numbered = []
+        for p in paths:
+            update = os.path.basename(p)[len(self.name) + 1:-len('.pt')]
+            if update.isdigit():
+                numbered.append((int(update), p))
+        return [p for _, p in sorted(numbered)]
+
+
+def _atomic_save(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """torch.load on the CPU, checkpoints pickle more than tensors (running stats, RNG states)."""
+    try:
+        return torch.load(path, map_location='cpu', weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no weights_only and always unpickles
+        return torch.load(path, map_location='cpu')
+
+
+def rng_state():
+    """The states of the Python, NumPy and torch (CPU and CUDA) generators."""
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def load_policy(path, obs_shape, action_space):
+    """Load the policy and observation normalization of a checkpoint.
+
+    Returns (actor_critic, ob_rms), also for the old format that pickled the
+    whole module.
+    """
+    checkpoint = load_checkpoint(path)
+    if isinstance(checkpoint, (list, tuple)):
+        return checkpoint
+
+    actor_critic = Policy(obs_shape, action_space, base_kwargs=checkpoint['base_kwargs'])
+    if checkpoint.get('split_bias', False):
+        split_bias(actor_critic)
+    actor_critic.load_state_dict(checkpoint['actor_critic'])
+    return actor_critic, checkpoint['ob_rms']
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils import get_vec_normalize
+
+
+def init_learner(rank, world_size, port):
+    """Join the gloo process group of the local data-parallel learners."""
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def all_reduce_mean(tensors):
+    """Average tensors in-place across learners with a single collective call."""
+    tensors = [t for t in tensors if t is not None]
+    if not is_distributed() or len(tensors) == 0:
+        return
+
+    flat = torch.cat([t.reshape(-1) for t in tensors])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+
+    offset = 0
+    for t in tensors:
+        numel = t.numel()
+        t.copy_(flat[offset:offset + numel].view_as(t))
+        offset += numel
+
+
+def all_gather_object(obj):
+    """The picklable obj of every learner, as a list indexed by rank."""
+    if not is_distributed():
+        return [obj]
+    objs = [None] * dist.get_world_size()
+    dist.all_gather_object(objs, obj)
+    return objs
+
+
+def broadcast_module(module, src=0):
+    """Make every learner start from the parameters of learner src."""
+    if not is_distributed():
+        return
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(tensor.data, src)
+
+
+def _sync_running_mean_std(rms):
+    # All learners see the same number of samples, so the pooled statistics
+    # are the plain averages of the means and of E[x^2]
+    mean = torch.from_numpy(np.asarray(rms.mean, dtype=np.float64))
+    sq_mean = torch.from_numpy(np.asarray(rms.var + np.square(rms.mean), dtype=np.float64))
+    count = torch.tensor([float(rms.count)], dtype=torch.float64)
+    all_reduce_mean([mean, sq_mean, count])
+
+    rms.mean = mean.numpy().reshape(np.shape(rms.mean))
+    rms.var = (sq_mean - mean.pow(2)).clamp(min=0).numpy().reshape(np.shape(rms.var))
+    rms.count = count.item()
+
+
+def sync_vec_normalize(venv):
+    """Average the VecNormalize observation and return statistics across learners."""
+    vec_norm = get_vec_normalize(venv)
+    if not is_distributed() or vec_norm is None:
+        return
+    for rms in [vec_norm.ob_rms, vec_norm.ret_rms]:
+        if rms is not None:
+            _sync_running_mean_std(rms)
@@ -4,6 +4,7 @@ import os
 import numpy as np
 import torch
 
+from checkpoint import load_policy
 from envs import VecPyTorch, make_vec_envs
 from utils import get_render_func, get_vec_normalize
 
@@ -33,8 +34,8 @@ env = make_vec_envs(args.env_name, args.seed + 1000, 1,
 render_func = get_render_func(env)
 
 # We need to use the same statistics for normalization as used in training
-actor_critic, ob_rms = \
-            torch.load(os.path.join(args.load_dir, args.env_name + ".pt"))
+actor_critic, ob_rms = load_policy(os.path.join(args.load_dir, args.env_name + ".pt"),
+                                   env.observation_space.shape, env.action_space)
 
 vec_norm = get_vec_normalize(env)
 if vec_norm is not None:
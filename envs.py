@@ -1,82 +1,34 @@
-import os
-
 import gym
 import numpy as np
 import torch
-from gym.spaces.box import Box
 
-from baselines import bench
-from baselines.common.atari_wrappers import make_atari, wrap_deepmind
 from baselines.common.vec_env import VecEnvWrapper
 from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
 from baselines.common.vec_env.vec_normalize import VecNormalize as VecNormalize_
 
+from tensor_envs import make_tensor_vec_env
+from worker_envs import (AddTimestep, MaskGoal, TransitionCache, TransposeImage,  # noqa: F401
+                         cache_transitions, make_env)
 
-try:
-    import dm_control2gym
-except ImportError:
-    pass
-
-try:
-    import roboschool
-except ImportError:
-    pass
-
-try:
-    import pybullet_envs
-except ImportError:
-    pass
-
-
-def make_env(env_id, seed, rank, log_dir, add_timestep, allow_early_resets):
-    def _thunk():
-        if env_id.startswith("dm"):
-            _, domain, task = env_id.split('.')
-            env = dm_control2gym.make(domain_name=domain, task_name=task)
-        else:
-            env = gym.make(env_id)
-
-        is_atari = hasattr(gym.envs, 'atari') and isinstance(
-            env.unwrapped, gym.envs.atari.atari_env.AtariEnv)
-        if is_atari:
-            env = make_atari(env_id)
-
-        env.seed(seed + rank)
-
-        obs_shape = env.observation_space.shape
-
-        if add_timestep and len(
-                obs_shape) == 1 and str(env).find('TimeLimit') > -1:
-            env = AddTimestep(env)
-
-        if log_dir is not None:
-            env = bench.Monitor(env, os.path.join(log_dir, str(rank)),
-                                allow_early_resets=allow_early_resets)
-
-        if is_atari:
-            if len(env.observation_space.shape) == 3:
-                env = wrap_deepmind(env)
-        elif len(env.observation_space.shape) == 3:
-            raise NotImplementedError("CNN models work only for atari,\n"
-                "please use a custom wrapper for a custom pixel input env.\n"
-                "See wrap_deepmind for an example.")
-        
-        # If the input has shape (W,H,3), wrap for PyTorch convolutions
-        obs_shape = env.observation_space.shape
-        if len(obs_shape) == 3 and obs_shape[2] in [1, 3]:
-            env = TransposeImage(env)
-
-        return env
-
-    return _thunk
 
 def make_vec_envs(env_name, seed, num_processes, gamma, log_dir, add_timestep,
-                  device, allow_early_resets, num_frame_stack=None):
-    envs = [make_env(env_name, seed, i, log_dir, add_timestep, allow_early_resets)
+                  device, allow_early_resets, num_frame_stack=None, start_rank=0, log_suffix='',
+                  backend=None, transition_cache_mb=None):
+    if env_name.startswith("tensor."):
+        # All envs are stepped as batched torch ops in this process, there are
+        # no workers and no observation normalization
+        return make_tensor_vec_env(env_name[len("tensor."):], num_processes, device, seed + start_rank,
+                                   log_dir, log_name=str(start_rank) + log_suffix)
+
+    envs = [make_env(env_name, seed, start_rank + i, log_dir, add_timestep, allow_early_resets,
+                     log_suffix=log_suffix, transition_cache_mb=transition_cache_mb)
             for i in range(num_processes)]
 
-    if len(envs) > 1:
+    if backend is None:
+        backend = 'subproc' if len(envs) > 1 else 'dummy'
+
+    if backend == 'subproc':
         envs = SubprocVecEnv(envs)
     else:
         envs = DummyVecEnv(envs)
@@ -97,41 +49,6 @@ def make_vec_envs(env_name, seed, num_processes, gamma, log_dir, add_timestep,
     return envs
 
 
-# Can be used to test recurrent policies for Reacher-v2
-class MaskGoal(gym.ObservationWrapper):
-    def observation(self, observation):
-        if self.env._elapsed_steps > 0:
-            observation[-2:0] = 0
-        return observation
-
-
-class AddTimestep(gym.ObservationWrapper):
-    def __init__(self, env=None):
-        super(AddTimestep, self).__init__(env)
-        self.observation_space = Box(
-            self.observation_space.low[0],
-            self.observation_space.high[0],
-            [self.observation_space.shape[0] + 1],
-            dtype=self.observation_space.dtype)
-
-    def observation(self, observation):
-        return np.concatenate((observation, [self.env._elapsed_steps]))
-
-
-class TransposeImage(gym.ObservationWrapper):
-    def __init__(self, env=None):
-        super(TransposeImage, self).__init__(env)
-        obs_shape = self.observation_space.shape
-        self.observation_space = Box(
-            self.observation_space.low[0, 0, 0],
-            self.observation_space.high[0, 0, 0],
-            [obs_shape[2], obs_shape[1], obs_shape[0]],
-            dtype=self.observation_space.dtype)
-
-    def observation(self, observation):
-        return observation.transpose(2, 0, 1)
-
-
 class VecPyTorch(VecEnvWrapper):
     def __init__(self, venv, device):
         """Return only every `skip`-th frame"""
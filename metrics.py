@@ -0,0 +1,87 @@
+import queue
+import struct
+import threading
+
+
+class MetricsWriter(object):
+    """Writes tensorboard scalars and histograms on a background thread.
+
+    Scalars are buffered and handed to the writer thread as one batch per
+    `flush`. `add_histogram` only copies the tensor on the calling thread, the
+    numpy conversion and histogram computation happen off-thread. At most
+    `max_queue` batches and histograms are pending; histograms arriving while
+    the queue is full are dropped and counted in `dropped`, scalar batches
+    are never dropped.
+    """
+    def __init__(self, summary_writer, max_queue=64):
+        self.summary_writer = summary_writer
+        self.dropped = 0
+
+        self._scalars = []
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_scalar(self, tag, value, step):
+        self._scalars.append((tag, value, step))
+
+    def add_histogram(self, tag, values, step):
+        try:
+            self._queue.put_nowait(('histogram', tag, values.detach().to('cpu', copy=True), step))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Hand the buffered scalars to the writer thread."""
+        if self._scalars:
+            scalars, self._scalars = self._scalars, []
+            self._queue.put(('scalars', scalars))
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self.summary_writer.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            if item[0] == 'scalars':
+                for tag, value, step in item[1]:
+                    self.summary_writer.add_scalar(tag, value, step)
+                # Readers of the event file (e.g. sweep.py) see every log interval
+                self.summary_writer.flush()
+            else:
+                _, tag, values, step = item
+                self.summary_writer.add_histogram(tag, values.numpy(), step)
+
+
+def read_scalars(path):
+    """Scalars of a tensorboard event file as {tag: [(step, value), ...]}.
+
+    Reading stops at a partially written record, so the files of running
+    jobs can be read.
+    """
+    from tensorboardX.proto import event_pb2
+
+    scalars = {}
+    with open(path, 'rb') as f:
+        while True:
+            # Records are a little-endian uint64 length and its crc, the data and its crc
+            header = f.read(12)
+            if len(header) < 12:
+                break
+            length, = struct.unpack('<Q', header[:8])
+            data = f.read(length + 4)
+            if len(data) < length + 4:
+                break
+
+            event = event_pb2.Event()
+            event.ParseFromString(data[:length])
+            for value in event.summary.value:
+                if value.HasField('simple_value'):
+                    scalars.setdefault(value.tag, []).append((event.step, value.simple_value))
+    return scalars
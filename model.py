@@ -1,3 +1,5 @@
+import copy
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -74,6 +76,100 @@ class Policy(nn.Module):
         return value, action_log_probs, dist_entropy, rnn_hxs
 
 
+class PolicyPopulation(object):
+    """Evaluate P policies with identical architecture in one batched call.
+
+    The parameters of all members are stacked along a leading population
+    dimension and every member's parameters are re-pointed at its slice, so
+    each member can still be trained by its own agent and the batched forward
+    always sees the latest weights. All inputs and outputs of `act`,
+    `get_value` and `evaluate_actions` carry a leading dimension of size P.
+
+    Create the agents (in particular KFACOptimizer, which restructures the
+    model) before building the population.
+    """
+    def __init__(self, policies):
+        from torch.func import stack_module_state
+
+        assert not policies[0].is_recurrent, \
+            'Recurrent policies are not supported in population mode'
+
+        self.policies = policies
+        self.params, self.buffers = stack_module_state(policies)
+
+        for i, policy in enumerate(policies):
+            for name, param in policy.named_parameters():
+                param.data = self.params[name].data[i]
+            for name, buf in policy.named_buffers():
+                buf.data = self.buffers[name][i]
+
+        self._template = copy.deepcopy(policies[0]).to('meta')
+
+    def __len__(self):
+        return len(self.policies)
+
+    @property
+    def recurrent_hidden_state_size(self):
+        return self.policies[0].recurrent_hidden_state_size
+
+    def _member_forward(self, params, buffers, inputs, rnn_hxs, masks):
+        from torch.func import functional_call
+
+        tensors = dict(params, **buffers)
+        base = {k[len('base.'):]: v for k, v in tensors.items() if k.startswith('base.')}
+        dist = {k[len('dist.'):]: v for k, v in tensors.items() if k.startswith('dist.')}
+
+        value, actor_features, rnn_hxs = functional_call(
+            self._template.base, base, (inputs, rnn_hxs, masks))
+        return value, functional_call(self._template.dist, dist, (actor_features,)), rnn_hxs
+
+    def act(self, inputs, rnn_hxs, masks, deterministic=False):
+        from torch.func import vmap
+
+        def _act(params, buffers, inputs, rnn_hxs, masks):
+            value, dist, rnn_hxs = self._member_forward(params, buffers, inputs, rnn_hxs, masks)
+            if deterministic:
+                action = dist.mode()
+            else:
+                action = dist.sample()
+            return value, action, dist.log_probs(action), rnn_hxs
+
+        return vmap(_act, randomness='different')(
+            self.params, self.buffers, inputs, rnn_hxs, masks)
+
+    def get_value(self, inputs, rnn_hxs, masks):
+        from torch.func import vmap
+
+        def _get_value(params, buffers, inputs, rnn_hxs, masks):
+            return self._member_forward(params, buffers, inputs, rnn_hxs, masks)[0]
+
+        return vmap(_get_value)(self.params, self.buffers, inputs, rnn_hxs, masks)
+
+    def evaluate_actions(self, inputs, rnn_hxs, masks, action):
+        """Returns values, log probs, per-member entropy (P,) and rnn_hxs.
+
+        Gradients flow into the stacked parameters, call `scatter_grads` to
+        hand them to the members' optimizers.
+        """
+        from torch.func import vmap
+
+        def _evaluate_actions(params, buffers, inputs, rnn_hxs, masks, action):
+            value, dist, rnn_hxs = self._member_forward(params, buffers, inputs, rnn_hxs, masks)
+            return value, dist.log_probs(action), dist.entropy().mean(), rnn_hxs
+
+        return vmap(_evaluate_actions)(
+            self.params, self.buffers, inputs, rnn_hxs, masks, action)
+
+    def scatter_grads(self):
+        """Expose the gradients of the stacked parameters as member gradients."""
+        for name, stacked in self.params.items():
+            if stacked.grad is None:
+                continue
+            for i, policy in enumerate(self.policies):
+                policy.get_parameter(name).grad = stacked.grad[i]
+            stacked.grad = None
+
+
 class NNBase(nn.Module):
 
     def __init__(self, recurrent, recurrent_input_size, hidden_size):
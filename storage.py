@@ -6,8 +6,45 @@ def _flatten_helper(T, N, _tensor):
     return _tensor.view(T * N, *_tensor.size()[2:])
 
 
+def split_microbatches(batch, microbatch_size, num_envs=None):
+    """Split a batch of tensors into microbatches of at most microbatch_size samples.
+
+    Yields (microbatch, weight) where weight is the microbatch's fraction of the
+    batch, so summing weight * microbatch mean losses gives the full-batch loss.
+    If num_envs is given the tensors are flattened (T, num_envs, ...) sequences
+    (or (num_envs, ...) per-env tensors such as the initial recurrent states) and
+    are split along the env dimension, keeping whole sequences together, so a
+    microbatch has at least one sequence even if it is longer than
+    microbatch_size (check_args rejects that case for training).
+    """
+    batch_size = batch[0].size(0)
+    if microbatch_size is None or batch_size <= microbatch_size:
+        yield batch, 1.0
+        return
+
+    if num_envs is None:
+        for start in range(0, batch_size, microbatch_size):
+            end = min(start + microbatch_size, batch_size)
+            yield tuple(t[start:end] for t in batch), (end - start) / float(batch_size)
+        return
+
+    T = batch_size // num_envs
+    envs_per_microbatch = max(1, microbatch_size // T)
+    for start in range(0, num_envs, envs_per_microbatch):
+        end = min(start + envs_per_microbatch, num_envs)
+        microbatch = []
+        for t in batch:
+            if t.size(0) == num_envs:
+                microbatch.append(t[start:end])
+            else:
+                t = t.view(T, num_envs, *t.size()[1:])[:, start:end]
+                microbatch.append(_flatten_helper(T, end - start, t.contiguous()))
+        yield tuple(microbatch), (end - start) / float(num_envs)
+
+
 class RolloutStorage(object):
-    def __init__(self, num_steps, num_processes, obs_shape, action_space, recurrent_hidden_state_size):
+    def __init__(self, num_steps, num_processes, obs_shape, action_space, recurrent_hidden_state_size,
+                 feature_size=None):
         self.obs = torch.zeros(num_steps + 1, num_processes, *obs_shape)
         self.recurrent_hidden_states = torch.zeros(num_steps + 1, num_processes, recurrent_hidden_state_size)
         self.rewards = torch.zeros(num_steps, num_processes, 1)
@@ -30,6 +67,11 @@ class RolloutStorage(object):
         # TODO: refactor code to just get this from obs by shifting indices
         self.prev_obs = torch.zeros(num_steps + 1, num_processes, *obs_shape)
 
+        # Curiosity encoder features of obs, so every observation is encoded once
+        self.features = None
+        if feature_size is not None:
+            self.features = torch.zeros(num_steps + 1, num_processes, feature_size)
+
     def to(self, device):
         self.obs = self.obs.to(device)
         self.recurrent_hidden_states = self.recurrent_hidden_states.to(device)
@@ -39,8 +81,11 @@ class RolloutStorage(object):
         self.action_log_probs = self.action_log_probs.to(device)
         self.actions = self.actions.to(device)
         self.masks = self.masks.to(device)
+        if self.features is not None:
+            self.features = self.features.to(device)
 
-    def insert(self, obs, recurrent_hidden_states, actions, action_log_probs, value_preds, rewards, masks, prev_obs=None):
+    def insert(self, obs, recurrent_hidden_states, actions, action_log_probs, value_preds, rewards, masks, prev_obs=None,
+               features=None):
         self.obs[self.step + 1].copy_(obs)
         self.recurrent_hidden_states[self.step + 1].copy_(recurrent_hidden_states)
         self.actions[self.step].copy_(actions)
@@ -50,6 +95,8 @@ class RolloutStorage(object):
         self.masks[self.step + 1].copy_(masks)
         if prev_obs is not None:
             self.prev_obs[self.step + 1].copy_(prev_obs)
+        if features is not None:
+            self.features[self.step + 1].copy_(features)
 
         self.step = (self.step + 1) % self.num_steps
 
@@ -60,6 +107,8 @@ class RolloutStorage(object):
 
         # Should this go here?? Seems odd to have prev_obs have the same number of elements as obs
         self.prev_obs[0].copy_(self.prev_obs[-1])
+        if self.features is not None:
+            self.features[0].copy_(self.features[-1])
 
     def compute_returns(self, next_value, use_gae, gamma, tau):
         if use_gae:
@@ -0,0 +1,264 @@
+"""Run a grid of main.py configurations in parallel on a fixed budget of cores.
+
+Every combination of the --grid values is a run of main.py with the other
+arguments. Each run gets its own cores, one for each learner (--num-learners)
+and one per env worker of each learner (--num-processes, none for tensor.*
+envs), and runs start as soon as
+enough cores are free. Runs write to <output>/<index>/ and their
+tensorboard scalars are collected into <output>/summary.json, summary.csv
+and a table:
+
+    python sweep.py --grid seed=1,2,3 lr=7e-4,2.5e-4 --cores 0-15 --output sweeps/pong \\
+        --env-name "PongNoFrameskip-v4" --algo ppo --use-gae --num-processes 4
+
+With --halving-rungs R, runs are stopped early by asynchronous successive
+halving: when a run reaches num_env_steps / eta^k steps (k = R..1), its
+--metric is compared to those of the runs that reached the same rung
+before it, and it is stopped unless it is in their top 1 / eta.
+
+Boolean flags take true or false, e.g. --grid use_gae=true,false.
+"""
+import argparse
+import csv
+import glob
+import itertools
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from arguments import get_args
+from metrics import read_scalars
+from threads import parse_cores
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def get_sweep_args():
+    parser = argparse.ArgumentParser(description='Sweep', add_help=False)
+    parser.add_argument('--grid', nargs='+', default=[],
+                        help='name=value1,value2,... for every swept argument (dest names, e.g. num_steps)')
+    parser.add_argument('--cores', default=None,
+                        help='cores to run on, e.g. 0-15 (default: the cores this process may use)')
+    parser.add_argument('--no-pin', action='store_true', default=False,
+                        help='only count cores, do not pin the runs to them')
+    parser.add_argument('--output', default='sweep')
+    parser.add_argument('--metric', default='mean_reward',
+                        help='tensorboard scalar compared by successive halving and sorting the summary')
+    parser.add_argument('--summary-tags', nargs='+', default=['mean_reward', 'median_reward', 'dist_entropy',
+                                                              'value_loss'])
+    parser.add_argument('--halving-rungs', type=int, default=0,
+                        help='number of successive halving rungs (default: 0, no early stopping)')
+    parser.add_argument('--halving-eta', type=float, default=3)
+    parser.add_argument('--poll-interval', type=float, default=5)
+    sweep_args, rest = parser.parse_known_args()
+    return sweep_args, rest
+
+
+def parse_grid(grid):
+    """[(name, [value, ...]), ...] of name=value1,value2 strings."""
+    axes = []
+    for item in grid:
+        name, values = item.split('=', 1)
+        axes.append((name, values.split(',')))
+    return axes
+
+
+def to_argv(params):
+    argv = []
+    for name, value in params:
+        flag = '--' + name.replace('_', '-')
+        if value.lower() == 'true':
+            argv.append(flag)
+        elif value.lower() != 'false':
+            argv += [flag, value]
+    return argv
+
+
+class Run(object):
+    def __init__(self, index, params, base_argv, output):
+        self.index = index
+        self.params = params
+        self.name = ','.join('{}={}'.format(name, value) for name, value in params)
+        self.dir = os.path.join(output, '{:03d}'.format(index))
+        self.argv = base_argv + to_argv(params) + ['--log-dir', os.path.join(self.dir, 'logs'),
+                                                   '--save-dir', self.dir]
+
+        args = get_args(self.argv)
+        self.num_env_steps = args.num_env_steps
+        self.num_learners = args.num_learners
+        # tensor.* envs are stepped by the learner, every data-parallel learner has its own workers
+        if args.env_name.startswith('tensor.'):
+            self.num_cores = args.num_learners
+        else:
+            self.num_cores = args.num_learners * (1 + args.num_processes)
+
+        self.status = 'pending'
+        self.process = None
+        self.cores = None
+        self.rung = 0
+
+    def start(self, cores, pin):
+        self.cores = cores
+        argv = list(self.argv)
+        if pin:
+            # The learners split both lists evenly, so learner i gets cores[i]
+            # and the i-th slice of the env cores
+            argv += ['--learner-cores', ','.join(str(core) for core in cores[:self.num_learners])]
+            if len(cores) > self.num_learners:
+                argv += ['--env-cores', ','.join(str(core) for core in cores[self.num_learners:])]
+
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, 'argv.json'), 'w') as f:
+            json.dump(argv, f)
+        self.output = open(os.path.join(self.dir, 'output.txt'), 'w')
+        # In its own process group, so stop() also reaches the spawned learners and env workers
+        self.process = subprocess.Popen([sys.executable, MAIN] + argv, stdout=self.output,
+                                        stderr=subprocess.STDOUT, start_new_session=True)
+        self.status = 'running'
+
+    def poll(self):
+        """Update the status, True once the process has exited."""
+        returncode = self.process.poll()
+        if returncode is None:
+            return False
+        if self.status == 'running':
+            self.status = 'done' if returncode == 0 else 'failed'
+        self.output.close()
+        return True
+
+    def stop(self):
+        self.status = 'stopped'
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def scalars(self):
+        scalars = {}
+        for path in sorted(glob.glob(os.path.join(self.dir, '**', 'events.out.tfevents.*'), recursive=True)):
+            for tag, values in read_scalars(path).items():
+                scalars.setdefault(tag, []).extend(values)
+        return scalars
+
+
+class SuccessiveHalving(object):
+    """Asynchronous successive halving on the last value of a scalar."""
+    def __init__(self, metric, num_rungs, eta):
+        self.metric = metric
+        self.num_rungs = num_rungs
+        self.eta = eta
+        self.results = [[] for _ in range(num_rungs)]
+
+    def should_stop(self, run, scalars):
+        values = scalars.get(self.metric, [])
+        while run.rung < self.num_rungs and values:
+            rung_steps = run.num_env_steps / self.eta ** (self.num_rungs - run.rung)
+            reached = [value for step, value in values if step >= rung_steps]
+            if not reached:
+                return False
+            value = reached[0]
+            results = self.results[run.rung]
+            results.append(value)
+            run.rung += 1
+
+            # Too few results at this rung to judge
+            if len(results) < self.eta:
+                continue
+            top = sorted(results, reverse=True)[:max(1, int(len(results) / self.eta))]
+            if value < top[-1]:
+                return True
+        return False
+
+
+def summarize(runs, sweep_args):
+    rows = []
+    for run in runs:
+        scalars = run.scalars()
+        row = {'run': run.index, 'params': dict(run.params), 'status': run.status,
+               'steps': max((step for values in scalars.values() for step, _ in values), default=0)}
+        row['scalars'] = {tag: values[-1][1] for tag, values in scalars.items()}
+        rows.append(row)
+
+    def key(row):
+        value = row['scalars'].get(sweep_args.metric)
+        return -math.inf if value is None else value
+    rows.sort(key=key, reverse=True)
+
+    with open(os.path.join(sweep_args.output, 'summary.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    names = [name for name, _ in runs[0].params] if runs else []
+    header = ['run'] + names + ['status', 'steps'] + sweep_args.summary_tags
+    table = []
+    for row in rows:
+        scalars = [row['scalars'].get(tag) for tag in sweep_args.summary_tags]
+        table.append(['{:03d}'.format(row['run'])] + [row['params'][name] for name in names] +
+                     [row['status'], str(row['steps'])] +
+                     ['' if value is None else '{:.4g}'.format(value) for value in scalars])
+
+    with open(os.path.join(sweep_args.output, 'summary.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(table)
+
+    widths = [max(len(line[i]) for line in [header] + table) for i in range(len(header))]
+    for line in [header] + table:
+        print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def main():
+    sweep_args, base_argv = get_sweep_args()
+
+    cores = sorted(parse_cores(sweep_args.cores) if sweep_args.cores is not None else os.sched_getaffinity(0))
+    axes = parse_grid(sweep_args.grid)
+    names = [name for name, _ in axes]
+    runs = [Run(i, list(zip(names, values)), base_argv, sweep_args.output)
+            for i, values in enumerate(itertools.product(*[values for _, values in axes]))]
+    for run in runs:
+        assert run.num_cores <= len(cores), \
+            'Run {} needs {} cores, only {} in the budget'.format(run.name, run.num_cores, len(cores))
+
+    halving = None
+    if sweep_args.halving_rungs > 0:
+        halving = SuccessiveHalving(sweep_args.metric, sweep_args.halving_rungs, sweep_args.halving_eta)
+
+    os.makedirs(sweep_args.output, exist_ok=True)
+    print("{} runs on {} cores".format(len(runs), len(cores)))
+
+    pending = list(runs)
+    running = []
+    free_cores = list(cores)
+    try:
+        while pending or running:
+            # Start runs in order while their cores are free
+            while pending and pending[0].num_cores <= len(free_cores):
+                run = pending.pop(0)
+                run.start(free_cores[:run.num_cores], not sweep_args.no_pin)
+                free_cores = free_cores[run.num_cores:]
+                running.append(run)
+                print("started {:03d} {} on cores {}".format(run.index, run.name, run.cores))
+
+            time.sleep(sweep_args.poll_interval)
+
+            for run in list(running):
+                if halving is not None and run.status == 'running' and \
+                        halving.should_stop(run, run.scalars()):
+                    run.stop()
+                if run.poll():
+                    running.remove(run)
+                    free_cores = sorted(free_cores + run.cores)
+                    print("{} {:03d} {}".format(run.status, run.index, run.name))
+    finally:
+        for run in running:
+            run.stop()
+            run.process.wait()
+
+    summarize(runs, sweep_args)
+
+
+if __name__ == "__main__":
+    main()
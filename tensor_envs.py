@@ -0,0 +1,202 @@
+import json
+import math
+import os
+import time
+
+import numpy as np
+import torch
+from gym.spaces.box import Box
+from gym.spaces.discrete import Discrete
+
+
+class TensorVecEnv(object):
+    """Vectorized environment whose state lives in tensors.
+
+    All envs are stepped with batched torch ops in the calling process and
+    observations, rewards and dones are returned as tensors on `device`, with
+    the reset/step_async/step_wait interface of VecPyTorch. Finished envs are
+    reset automatically and their episode statistics are reported in the
+    infos and, if log_path is given, in a monitor CSV like bench.Monitor.
+
+    Subclasses implement _reset(mask), _step(actions) -> (reward, terminated)
+    and _obs().
+    """
+    def __init__(self, num_envs, observation_space, action_space, max_episode_steps,
+                 device='cpu', seed=0, log_path=None, dtype=torch.float32):
+        self.num_envs = num_envs
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.max_episode_steps = max_episode_steps
+        self.device = torch.device(device)
+        self.dtype = dtype
+
+        self.generator = torch.Generator(device=self.device)
+        self.generator.manual_seed(seed)
+
+        self.episode_steps = torch.zeros(num_envs, dtype=torch.long, device=self.device)
+        self.episode_returns = torch.zeros(num_envs, dtype=dtype, device=self.device)
+        self.actions = None
+
+        self.monitor_file = None
+        self.t_start = time.time()
+        if log_path is not None:
+            self.monitor_file = open(log_path + '.monitor.csv', 'wt')
+            self.monitor_file.write('#' + json.dumps({'t_start': self.t_start}) + '\n')
+            self.monitor_file.write('r,l,t\n')
+            self.monitor_file.flush()
+
+    def _rand(self, *size):
+        return torch.rand(*size, generator=self.generator, device=self.device, dtype=self.dtype)
+
+    def reset(self):
+        everything = torch.ones(self.num_envs, dtype=torch.bool, device=self.device)
+        self._reset(everything)
+        self.episode_steps.zero_()
+        self.episode_returns.zero_()
+        return self._obs()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        reward, terminated = self._step(self.actions.view(self.num_envs, -1).squeeze(1))
+        self.episode_steps += 1
+        self.episode_returns += reward
+
+        done = terminated | (self.episode_steps >= self.max_episode_steps)
+
+        # Envs only report something when their episode ended
+        infos = [{}] * self.num_envs
+        if done.any():
+            indices = done.nonzero().view(-1)
+            episodes = zip(indices.tolist(), self.episode_returns[indices].tolist(),
+                           self.episode_steps[indices].tolist())
+            for i, r, l in episodes:
+                episode = {'r': round(r, 6), 'l': l, 't': round(time.time() - self.t_start, 6)}
+                infos[i] = {'episode': episode}
+                if self.monitor_file is not None:
+                    self.monitor_file.write('{r},{l},{t}\n'.format(**episode))
+            if self.monitor_file is not None:
+                self.monitor_file.flush()
+
+            self._reset(done)
+            self.episode_steps[done] = 0
+            self.episode_returns[done] = 0
+
+        return self._obs(), reward.unsqueeze(1).float(), done, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.monitor_file is not None:
+            self.monitor_file.close()
+
+
+class CartPoleTensorEnv(TensorVecEnv):
+    """Batched CartPole-v1, same dynamics and termination as the gym version."""
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5
+    polemass_length = masspole * length
+    force_mag = 10.0
+    tau = 0.02
+    theta_threshold_radians = 12 * 2 * math.pi / 360
+    x_threshold = 2.4
+
+    def __init__(self, num_envs, **kwargs):
+        high = np.array([self.x_threshold * 2, np.finfo(np.float32).max,
+                         self.theta_threshold_radians * 2, np.finfo(np.float32).max],
+                        dtype=np.float32)
+        super(CartPoleTensorEnv, self).__init__(num_envs, Box(-high, high, dtype=np.float32),
+                                                Discrete(2), 500, **kwargs)
+        self.state = torch.zeros(num_envs, 4, dtype=self.dtype, device=self.device)
+
+    def _reset(self, mask):
+        self.state[mask] = self._rand(int(mask.sum()), 4) * 0.1 - 0.05
+
+    def _step(self, actions):
+        x, x_dot, theta, theta_dot = self.state.unbind(1)
+        force = (actions.to(self.dtype) * 2 - 1) * self.force_mag
+        costheta, sintheta = torch.cos(theta), torch.sin(theta)
+
+        temp = (force + self.polemass_length * theta_dot ** 2 * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / (
+            self.length * (4.0 / 3.0 - self.masspole * costheta ** 2 / self.total_mass))
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+
+        # Euler integration, like the gym version
+        x = x + self.tau * x_dot
+        x_dot = x_dot + self.tau * xacc
+        theta = theta + self.tau * theta_dot
+        theta_dot = theta_dot + self.tau * thetaacc
+        self.state = torch.stack([x, x_dot, theta, theta_dot], 1)
+
+        terminated = (x.abs() > self.x_threshold) | (theta.abs() > self.theta_threshold_radians)
+        reward = torch.ones(self.num_envs, dtype=self.dtype, device=self.device)
+        return reward, terminated
+
+    def _obs(self):
+        return self.state.float()
+
+
+class FrozenLakeTensorEnv(TensorVecEnv):
+    """Batched deterministic (is_slippery=False) FrozenLake-v1 gridworld.
+
+    Observations are one-hot encodings of the agent's cell.
+    """
+    maps = {
+        '4x4': ["SFFF", "FHFH", "FFFH", "HFFG"],
+        '8x8': ["SFFFFFFF", "FFFFFFFF", "FFFHFFFF", "FFFFFHFF",
+                "FFFHFFFF", "FHHFFFHF", "FHFFHFHF", "FFFHFFFG"],
+    }
+
+    def __init__(self, num_envs, map_name='4x4', **kwargs):
+        desc = self.maps[map_name]
+        self.nrow, self.ncol = len(desc), len(desc[0])
+        num_cells = self.nrow * self.ncol
+        max_episode_steps = 100 if map_name == '4x4' else 200
+        super(FrozenLakeTensorEnv, self).__init__(num_envs, Box(0, 1, (num_cells,), dtype=np.float32),
+                                                  Discrete(4), max_episode_steps, **kwargs)
+
+        cells = ''.join(desc)
+        self.start = cells.index('S')
+        self.holes = torch.tensor([c == 'H' for c in cells], device=self.device)
+        self.goals = torch.tensor([c == 'G' for c in cells], device=self.device)
+
+        # Next cell of every (cell, action), actions are left, down, right, up
+        row, col = np.divmod(np.arange(num_cells), self.ncol)
+        moves = [(row, np.maximum(col - 1, 0)), (np.minimum(row + 1, self.nrow - 1), col),
+                 (row, np.minimum(col + 1, self.ncol - 1)), (np.maximum(row - 1, 0), col)]
+        transitions = np.stack([r * self.ncol + c for r, c in moves], 1)
+        self.transitions = torch.from_numpy(transitions).to(self.device)
+
+        self.position = torch.full((num_envs,), self.start, dtype=torch.long, device=self.device)
+        self.eye = torch.eye(num_cells, device=self.device)
+
+    def _reset(self, mask):
+        self.position[mask] = self.start
+
+    def _step(self, actions):
+        self.position = self.transitions[self.position, actions.long()]
+        reward = self.goals[self.position].to(self.dtype)
+        terminated = self.holes[self.position] | self.goals[self.position]
+        return reward, terminated
+
+    def _obs(self):
+        return self.eye[self.position]
+
+
+TENSOR_ENVS = {
+    'CartPole-v1': CartPoleTensorEnv,
+    'FrozenLake-v1': FrozenLakeTensorEnv,
+    'FrozenLake8x8-v1': lambda num_envs, **kwargs: FrozenLakeTensorEnv(num_envs, map_name='8x8', **kwargs),
+}
+
+
+def make_tensor_vec_env(env_id, num_envs, device, seed, log_dir=None, log_name='0'):
+    log_path = None if log_dir is None else os.path.join(log_dir, log_name)
+    return TENSOR_ENVS[env_id](num_envs, device=device, seed=seed, log_path=log_path)
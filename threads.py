@@ -0,0 +1,92 @@
+import contextlib
+import os
+import time
+
+import torch
+
+
+def parse_cores(cores):
+    """Parse a core list like "0-3,8" into a set of core ids (None stays None)."""
+    if cores is None:
+        return None
+    result = set()
+    for part in cores.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            result.update(range(int(first), int(last) + 1))
+        else:
+            result.add(int(part))
+    return result
+
+
+def learner_cores_share(cores, rank, num_learners):
+    """The slice of a core set that data-parallel learner rank pins to.
+
+    The sorted cores are split into num_learners contiguous parts; with
+    fewer cores than learners each learner gets one, shared round-robin.
+    """
+    if cores is None or num_learners == 1:
+        return cores
+    cores = sorted(cores)
+    if len(cores) < num_learners:
+        return {cores[rank % len(cores)]}
+    return set(cores[rank * len(cores) // num_learners:(rank + 1) * len(cores) // num_learners])
+
+
+def worker_pids(venv):
+    """Process ids of the env workers of a (wrapped) SubprocVecEnv."""
+    while venv is not None:
+        if hasattr(venv, 'ps'):
+            return [p.pid for p in venv.ps]
+        venv = getattr(venv, 'venv', None)
+    return []
+
+
+def pin_processes(envs, learner_cores=None, env_cores=None):
+    """Restrict the learner and the env worker processes to sets of cores."""
+    if learner_cores is not None:
+        os.sched_setaffinity(0, learner_cores)
+    if env_cores is not None:
+        for pid in worker_pids(envs):
+            os.sched_setaffinity(pid, env_cores)
+
+
+class ThreadScheduler(object):
+    """Switches the torch intra-op threads between the phases of the training loop.
+
+    Collection runs with collect_threads so the env workers get the cores,
+    the update with update_threads while the workers are idle. The first
+    update is a warm-up, the next calibration_updates run single threaded
+    and the ones after with update_threads; `speedup` is the ratio of their
+    mean times once both are measured.
+    """
+    def __init__(self, collect_threads=1, update_threads=1, calibration_updates=3):
+        self.collect_threads = collect_threads
+        self.update_threads = update_threads
+        self.calibration_updates = calibration_updates
+
+        self.speedup = None
+        self._num_updates = 0
+        self._times = {1: 0., update_threads: 0.}
+
+    def collect(self):
+        torch.set_num_threads(self.collect_threads)
+
+    @contextlib.contextmanager
+    def update(self):
+        calibrating = self.update_threads > 1 and self.speedup is None and self._num_updates > 0
+        threads = self.update_threads
+        if calibrating and self._num_updates <= self.calibration_updates:
+            threads = 1
+
+        torch.set_num_threads(threads)
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        torch.set_num_threads(self.collect_threads)
+
+        self._num_updates += 1
+        if calibrating:
+            self._times[threads] += elapsed
+            if self._num_updates > 2 * self.calibration_updates:
+                self.speedup = self._times[1] / self._times[self.update_threads]
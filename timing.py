@@ -0,0 +1,62 @@
+import time
+from collections import defaultdict
+
+
+class _Phase(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class PhaseTimer(object):
+    """Accumulates the wall time spent in named phases of the training loop.
+
+    Phases can nest ("update" around "update/backward"), a phase of a given
+    name must not nest in itself. CUDA kernels run asynchronously, their time
+    is attributed to the phase that waits for them.
+    """
+    def __init__(self):
+        self._phases = {}
+        self.reset()
+
+    def reset(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.start = time.perf_counter()
+
+    def phase(self, name):
+        """Context manager that adds the time spent in it to `name`."""
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name, seconds):
+        self.totals[name] += seconds
+        self.counts[name] += 1
+
+    def summary(self, reset=True):
+        """Seconds and calls per phase since the last reset, and the interval length."""
+        summary = {
+            'interval': time.perf_counter() - self.start,
+            'phases': {name: {'time': self.totals[name], 'count': self.counts[name]}
+                       for name in sorted(self.totals)},
+        }
+        if reset:
+            self.reset()
+        return summary
+
+
+# The timer of the training loop, shared by main.py and the agents
+timer = PhaseTimer()
+
+
+def phase(name):
+    return timer.phase(name)
@@ -0,0 +1,649 @@
+import datetime
+import glob
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+import algo
+import distributed
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, set_rng_state
+from envs import make_vec_envs
+from metrics import MetricsWriter
+from model import Policy
+from storage import RolloutStorage
+from threads import ThreadScheduler, learner_cores_share, parse_cores, pin_processes
+from timing import phase, timer
+from utils import get_vec_normalize
+from utils import update_linear_schedule
+
+# tensorboardX, visdom plotting (matplotlib, scipy) and the curiosity models
+# are imported where they are used, the env packages by make_vec_envs, so
+# runs and spawned learners only pay for what --env-name and the flags need
+
+HOOK_EVENTS = ['collect', 'update', 'save', 'log', 'evaluate']
+
+
+def check_args(args):
+    assert args.algo in ['a2c', 'ppo', 'acktr']
+    assert args.keep_checkpoints >= 1, \
+        '--keep-checkpoints must be at least 1'
+    assert 0 < args.fisher_sample_fraction <= 1, \
+        '--fisher-sample-fraction must be in (0, 1]'
+    if args.fisher_sample_fraction != 1:
+        assert args.algo == 'acktr', \
+            'The Fisher sample fraction only applies to ACKTR'
+    if args.recurrent_policy:
+        assert args.algo in ['a2c', 'ppo'], \
+            'Recurrent policy is not implemented for ACKTR'
+    if args.bf16:
+        assert args.algo in ['a2c', 'ppo'], \
+            'bfloat16 updates are not implemented for ACKTR'
+    if args.microbatch_size is not None:
+        assert args.algo in ['a2c', 'ppo'], \
+            'Microbatching is not implemented for ACKTR'
+        if args.recurrent_policy:
+            # Recurrent microbatches hold whole env sequences of num_steps samples
+            assert args.microbatch_size >= args.num_steps, \
+                'Recurrent microbatches need --microbatch-size >= --num-steps ({})'.format(args.num_steps)
+
+
+def clean_log_dirs(args):
+    for d in [args.log_dir, args.log_dir + "_eval"]:
+        try:
+            os.makedirs(d)
+        except OSError:
+            # Keep the monitor logs of the interrupted run when resuming
+            if args.resume:
+                continue
+            # The CSVs and their binary episode logs
+            files = glob.glob(os.path.join(d, '*.monitor.*'))
+            for f in files:
+                os.remove(f)
+
+
+def intrinsic_reward(forward_model, features, next_features, actions, irsf):
+    """Curiosity bonus of (features, actions) -> next_features transitions."""
+    from rl_algos.utils import one_hot
+    next_features_pred = forward_model(features, one_hot(actions, max_val=forward_model.action_size))
+
+    # reward_i = args.irsf * torch.sum(torch.square(next_features_pred - feature_encoder(obs)), axis=1, keepdims=False) / 2.
+    return irsf * torch.sum((next_features_pred - next_features**2), 1, keepdim=True) / 2.
+
+
+def reset_vec_normalize(envs):
+    """Forget the observation and return statistics of a reused VecNormalize."""
+    vec_norm = get_vec_normalize(envs)
+    if vec_norm is None:
+        return
+    if vec_norm.ob_rms is not None:
+        vec_norm.ob_rms = type(vec_norm.ob_rms)(shape=vec_norm.ob_rms.mean.shape)
+    if vec_norm.ret_rms is not None:
+        vec_norm.ret_rms = type(vec_norm.ret_rms)(shape=())
+    vec_norm.ret = np.zeros(vec_norm.num_envs)
+
+
+class Trainer(object):
+    """One training run of main.py, built from its parsed arguments.
+
+    train() runs all updates like main.py. step() runs a single one:
+    collect() a rollout, update() the agent, then save(), log() and
+    evaluate() at their intervals, and advances update_index. Callbacks
+    added with add_hook(event, fn) are called as fn(trainer) after each of
+    these steps; a hook can end train() early with trainer.stop().
+
+    Drivers running many trainings in one process can pass the envs of a
+    previous run instead of spawning new workers. The workers are neither
+    re-seeded nor given new monitor files, so the run must use the same env,
+    number of processes, seed and log_dir as the one that created them, and
+    its episodes are appended to the same monitor logs. Their VecNormalize
+    statistics are reset and they are left open by close(); the run that
+    created them keeps them open with close(close_envs=False).
+    """
+    def __init__(self, args, rank=0, envs=None):
+        check_args(args)
+        self.args = args
+        self.rank = rank
+        # Only the first data-parallel learner logs, evaluates and saves
+        self.is_chief = rank == 0
+        self.hooks = {event: [] for event in HOOK_EVENTS}
+        self.stopped = False
+
+        # Data-parallel learners split the environment steps between them
+        self.steps_per_update = args.num_processes * args.num_steps * args.num_learners
+        self.num_updates = int(args.num_env_steps) // self.steps_per_update
+
+        # Data-parallel learners sample their actions from different streams,
+        # like their envs are seeded from start_rank
+        torch.manual_seed(args.seed + rank)
+        torch.cuda.manual_seed_all(args.seed + rank)
+
+        if args.cuda and torch.cuda.is_available() and args.cuda_deterministic:
+            torch.backends.cudnn.benchmark = False
+            torch.backends.cudnn.deterministic = True
+
+        self.eval_log_dir = args.log_dir + "_eval"
+
+        if args.num_learners > 1:
+            distributed.init_learner(rank, args.num_learners, args.dist_port)
+
+        # Few intra-op threads while the env workers step, more for the update
+        self.thread_scheduler = ThreadScheduler(args.collect_threads, args.update_threads)
+        self.thread_scheduler.collect()
+        self.device = device = torch.device("cuda:0" if args.cuda else "cpu")
+
+        if args.vis and self.is_chief:
+            from visdom import Visdom
+            from visualize import VisdomPlotter
+            # Reading the monitor logs and plotting happen on a background thread
+            self.plotter = VisdomPlotter(Visdom(port=args.port), args.log_dir, args.env_name,
+                                         args.algo, args.num_env_steps, episode_log=args.episode_log)
+
+        ts_str = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d_%H-%M-%S')
+        if args.curiosity:
+            self.tensorboard_dir = os.path.join(args.save_dir, 'curiosity', args.algo, args.env_name,
+                                                'tensorboard', ts_str)
+        else:
+            self.tensorboard_dir = os.path.join(args.save_dir, args.algo, args.env_name, 'tensorboard', ts_str)
+
+        if self.is_chief:
+            from tensorboardX import SummaryWriter
+            # Histograms and scalar writes happen on a background thread
+            self.tensorboard_writer = MetricsWriter(SummaryWriter(log_dir=self.tensorboard_dir))
+            # Per-phase time breakdown of every log interval
+            self.timing_log = open(os.path.join(self.tensorboard_dir, 'timing.jsonl'), 'a')
+
+        resume_state = None
+        self.start_update = 0
+        if args.resume:
+            checkpoint_path = os.path.join(args.save_dir, args.algo, args.env_name + ".pt")
+            resume_state = load_checkpoint(checkpoint_path)
+            assert isinstance(resume_state, dict) and 'update' in resume_state, \
+                'No training state to resume from in {}'.format(checkpoint_path)
+            self.start_update = resume_state['update'] + 1
+        self.update_index = self.start_update
+
+        self.owns_envs = envs is None
+        # What the env workers were seeded with and log to
+        env_config = (args.env_name, args.num_processes, args.seed, args.log_dir, rank)
+        if envs is None:
+            # Resumed runs write new monitor files next to the ones of the interrupted run
+            envs = make_vec_envs(args.env_name, args.seed, args.num_processes,
+                                 args.gamma, args.log_dir, args.add_timestep, device, False,
+                                 start_rank=rank * args.num_processes,
+                                 log_suffix='-resume{}'.format(self.start_update) if args.resume else '',
+                                 backend=args.vec_env_backend,
+                                 transition_cache_mb=args.transition_cache_mb)
+            # Every learner pins itself and its own env workers to its share of the cores
+            pin_processes(envs,
+                          learner_cores_share(parse_cores(args.learner_cores), rank, args.num_learners),
+                          learner_cores_share(parse_cores(args.env_cores), rank, args.num_learners))
+            envs.env_config = env_config
+        else:
+            assert envs.env_config == env_config, \
+                'Reused envs need the same env, num_processes, seed and log_dir, ' \
+                'they were created with {}'.format(envs.env_config)
+            reset_vec_normalize(envs)
+        self.envs = envs
+
+        self.base_kwargs = {'recurrent': args.recurrent_policy}
+        if args.policy == 'default':
+            actor_critic = Policy(envs.observation_space.shape, envs.action_space,
+                                  base_kwargs=self.base_kwargs)
+        elif args.policy == 'VIN':
+            actor_critic = Policy(envs.observation_space.shape, envs.action_space,
+                                  base_kwargs=self.base_kwargs)
+        else:
+            raise NotImplementedError
+
+        self.curiosity_modules = {}
+        if args.curiosity:
+            from rl_algos.curiosity.models import FeatureEncoder, ForwardModel, InverseModel
+            # TODO: add support for continuous actions
+            self.feature_encoder = FeatureEncoder(state_size=envs.observation_space.shape[0],
+                                                  feature_size=args.feature_size)
+            self.forward_model = ForwardModel(feature_size=args.feature_size, action_size=envs.action_space.n)
+            self.inverse_model = InverseModel(feature_size=args.feature_size, action_size=envs.action_space.n)
+            self.curiosity_modules = {'feature_encoder': self.feature_encoder,
+                                      'forward_model': self.forward_model,
+                                      'inverse_model': self.inverse_model}
+
+        actor_critic.to(device)
+        self.actor_critic = actor_critic
+        self.agent = self._make_agent()
+
+        if resume_state is not None:
+            actor_critic.load_state_dict(resume_state['actor_critic'])
+            self.agent.optimizer.load_state_dict(resume_state['optimizer'])
+            for name, module in self.curiosity_modules.items():
+                module.load_state_dict(resume_state[name])
+
+            vec_norm = get_vec_normalize(envs)
+            if vec_norm is not None:
+                vec_norm.ob_rms = resume_state['ob_rms']
+                vec_norm.ret_rms = resume_state['ret_rms']
+
+        self.checkpoint_writer = None
+        if args.save_dir != "" and self.is_chief:
+            self.checkpoint_writer = CheckpointWriter(os.path.join(args.save_dir, args.algo),
+                                                      args.env_name, keep=args.keep_checkpoints)
+
+        # Every learner starts from the weights of the first one
+        distributed.broadcast_module(actor_critic)
+        for module in self.curiosity_modules.values():
+            distributed.broadcast_module(module)
+
+        self.rollouts = RolloutStorage(args.num_steps, args.num_processes,
+                                       envs.observation_space.shape, envs.action_space,
+                                       actor_critic.recurrent_hidden_state_size,
+                                       feature_size=args.feature_size if args.curiosity else None)
+
+        self.obs = envs.reset()
+        self.prev_obs = torch.Tensor(self.obs.shape)
+        self.rollouts.obs[0].copy_(self.obs)
+        self.rollouts.to(device)
+
+        self.features = None
+        if args.curiosity:
+            with torch.no_grad():
+                self.rollouts.features[0].copy_(self.feature_encoder(self.rollouts.obs[0]))
+
+        self.episode_rewards = deque(maxlen=10)
+
+        self.episode_i_rewards = deque(maxlen=10)
+        self.episode_e_rewards = deque(maxlen=10)
+
+        self.ppo_update_time_saved = 0.
+        self.transition_cache_stats = None
+        self.update_stats = None
+        self.eval_episode_rewards = None
+
+        if resume_state is not None:
+            self.episode_rewards.extend(resume_state['episode_rewards'])
+            self.episode_i_rewards.extend(resume_state['episode_i_rewards'])
+            self.episode_e_rewards.extend(resume_state['episode_e_rewards'])
+            self.ppo_update_time_saved = resume_state['ppo_update_time_saved']
+            # Learners added since the checkpoint keep their fresh seed
+            if rank < len(resume_state['rng']):
+                set_rng_state(resume_state['rng'][rank])
+
+        self.start_num_steps = self.start_update * self.steps_per_update
+        self.start_time = time.time()
+
+    def _make_agent(self):
+        args = self.args
+        if args.algo == 'a2c':
+            return algo.A2C_ACKTR(self.actor_critic, args.value_loss_coef,
+                                  args.entropy_coef, lr=args.lr,
+                                  eps=args.eps, alpha=args.alpha,
+                                  max_grad_norm=args.max_grad_norm,
+                                  use_bf16=args.bf16,
+                                  microbatch_size=args.microbatch_size)
+        elif args.algo == 'ppo':
+            if args.curiosity:
+                return algo.CuriosityPPO(
+                    forward_model=self.forward_model, inverse_model=self.inverse_model,
+                    feature_encoder=self.feature_encoder,
+                    actor_critic=self.actor_critic, clip_param=args.clip_param, ppo_epoch=args.ppo_epoch,
+                    num_mini_batch=args.num_mini_batch, value_loss_coef=args.value_loss_coef,
+                    entropy_coef=args.entropy_coef, lr=args.lr, eps=args.eps, max_grad_norm=args.max_grad_norm,
+                    use_bf16=args.bf16, target_kl=args.target_kl,
+                    microbatch_size=args.microbatch_size
+                )
+            return algo.PPO(self.actor_critic, args.clip_param, args.ppo_epoch, args.num_mini_batch,
+                            args.value_loss_coef, args.entropy_coef, lr=args.lr,
+                            eps=args.eps,
+                            max_grad_norm=args.max_grad_norm,
+                            use_bf16=args.bf16,
+                            target_kl=args.target_kl,
+                            microbatch_size=args.microbatch_size)
+        elif args.algo == 'acktr':
+            return algo.A2C_ACKTR(self.actor_critic, args.value_loss_coef,
+                                  args.entropy_coef, acktr=True,
+                                  fisher_sample_fraction=args.fisher_sample_fraction,
+                                  kfac_kwargs={'async_eig': args.kfac_async_eig,
+                                               'low_rank': args.kfac_low_rank,
+                                               'low_rank_threshold': args.kfac_low_rank_threshold})
+        raise NotImplementedError
+
+    def add_hook(self, event, fn):
+        assert event in self.hooks, 'Unknown hook event {}, one of {}'.format(event, HOOK_EVENTS)
+        self.hooks[event].append(fn)
+
+    def _call_hooks(self, event):
+        for fn in self.hooks[event]:
+            fn(self)
+
+    def stop(self):
+        self.stopped = True
+
+    @property
+    def total_num_steps(self):
+        """Env steps of all learners once the current update is done."""
+        return (self.update_index + 1) * self.steps_per_update
+
+    def collect(self):
+        """Fill the rollout storage with args.num_steps steps of every env."""
+        args, rollouts, actor_critic = self.args, self.rollouts, self.actor_critic
+
+        for step in range(args.num_steps):
+            # Sample actions
+            with phase('act'), torch.no_grad():
+                value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
+                        rollouts.obs[step],
+                        rollouts.recurrent_hidden_states[step],
+                        rollouts.masks[step])
+
+            # prev_obs = obs.copy()
+            self.prev_obs.copy_(self.obs)
+
+            # Obser reward and next obs
+            with phase('env_send'):
+                self.envs.step_async(action)
+            with phase('env_wait'):
+                self.obs, reward, done, infos = self.envs.step_wait()
+
+            if args.curiosity and not args.batch_intrinsic_reward:
+                # TODO: make sure the operations here on on the correct dimensions for the vectors given
+                with phase('intrinsic_reward'), torch.no_grad():
+                    # The features of prev_obs were computed as the next features of the last step
+                    self.features = self.feature_encoder(self.obs)
+
+                    # Calculate intrinsic reward
+                    reward_i = intrinsic_reward(self.forward_model, rollouts.features[step], self.features,
+                                                action, args.irsf)
+
+                    # Keep track of intrinsic and extrinsic reward for tensorboard
+                    self.episode_i_rewards.append(reward_i[0])  # NOTE: super dumb hack
+                    self.episode_e_rewards.append(reward[0])  # NOTE: super dumb hack
+
+                    reward = reward * args.erw + reward_i * args.irw
+
+            for info in infos:
+                if 'episode' in info.keys():
+                    self.episode_rewards.append(info['episode']['r'])
+                if 'transition_cache' in info.keys():
+                    self.transition_cache_stats = info['transition_cache']
+
+            # If done then clean the history of observations.
+            if torch.is_tensor(done):
+                masks = (~done).float().unsqueeze(1)
+            else:
+                masks = torch.FloatTensor([[0.0] if done_ else [1.0]
+                                           for done_ in done])
+
+            # NOTE: only curiosity models will use prev_obs
+            #       there should be a way to not need it, since the information is already there,
+            #       but this is easier for now, ensures no indexing bugs show up
+            with phase('insert'):
+                rollouts.insert(self.obs, recurrent_hidden_states, action, action_log_prob, value, reward, masks,
+                                self.prev_obs, features=self.features)
+
+        if args.curiosity and args.batch_intrinsic_reward:
+            # Only extrinsic rewards were stored during collection, add the
+            # curiosity bonus for the whole rollout in large batches
+            with phase('intrinsic_reward'), torch.no_grad():
+                T, N = rollouts.rewards.size()[0:2]
+                rollouts.features[1:].copy_(self.feature_encoder(
+                    rollouts.obs[1:].view(T * N, *rollouts.obs.size()[2:])).view(T, N, -1))
+                reward_i = intrinsic_reward(self.forward_model,
+                                            rollouts.features[:-1].view(T * N, -1),
+                                            rollouts.features[1:].view(T * N, -1),
+                                            rollouts.actions.view(T * N, -1), args.irsf).view(T, N, 1)
+
+                # Keep track of intrinsic and extrinsic reward for tensorboard
+                self.episode_i_rewards.extend(reward_i[:, 0])  # NOTE: super dumb hack
+                self.episode_e_rewards.extend(rollouts.rewards[:, 0].clone())  # NOTE: super dumb hack
+
+                rollouts.rewards.mul_(args.erw).add_(reward_i * args.irw)
+
+        self._call_hooks('collect')
+
+    def update(self):
+        """Update the agent on the collected rollout, returns the losses and update time."""
+        args, agent, j = self.args, self.agent, self.update_index
+
+        if args.use_linear_lr_decay:
+            # decrease learning rate linearly
+            if args.algo == "acktr":
+                # use optimizer's learning rate since it's hard-coded in kfac.py
+                update_linear_schedule(agent.optimizer, j, self.num_updates, agent.optimizer.lr)
+            else:
+                update_linear_schedule(agent.optimizer, j, self.num_updates, args.lr)
+
+        if args.algo == 'ppo' and args.use_linear_lr_decay:
+            agent.clip_param = args.clip_param * (1 - j / float(self.num_updates))
+
+        with phase('compute_returns'):
+            with torch.no_grad():
+                next_value = self.actor_critic.get_value(self.rollouts.obs[-1],
+                                                         self.rollouts.recurrent_hidden_states[-1],
+                                                         self.rollouts.masks[-1]).detach()
+
+            self.rollouts.compute_returns(next_value, args.use_gae, args.gamma, args.tau)
+
+        update_start = time.time()
+        with phase('update'), self.thread_scheduler.update():
+            value_loss, action_loss, dist_entropy = agent.update(self.rollouts)
+        update_time = time.time() - update_start
+
+        if args.algo == 'ppo':
+            self.ppo_update_time_saved += agent.update_time_saved
+
+        self.rollouts.after_update()
+
+        distributed.sync_vec_normalize(self.envs)
+
+        self.update_stats = {'value_loss': value_loss, 'action_loss': action_loss,
+                             'dist_entropy': dist_entropy, 'update_time': update_time}
+        self._call_hooks('update')
+        return self.update_stats
+
+    def save(self):
+        """Checkpoint the training state, the write runs in the background."""
+        if self.args.save_dir == "":
+            return
+        with phase('checkpoint'):
+            # Every learner samples from its own RNG stream, the chief saves all of them
+            rng_states = distributed.all_gather_object(rng_state())
+            if self.checkpoint_writer is None:
+                return
+            # Only the snapshot happens here.
+            # The LR and clip schedules are functions of the update counter
+            vec_norm = get_vec_normalize(self.envs)
+            checkpoint = {
+                'actor_critic': self.actor_critic.state_dict(),
+                'base_kwargs': self.base_kwargs,
+                'split_bias': self.args.algo == 'acktr',
+                'optimizer': self.agent.optimizer.state_dict(),
+                'ob_rms': getattr(vec_norm, 'ob_rms', None),
+                'ret_rms': getattr(vec_norm, 'ret_rms', None),
+                'update': self.update_index,
+                'rng': rng_states,
+                'episode_rewards': list(self.episode_rewards),
+                'episode_i_rewards': list(self.episode_i_rewards),
+                'episode_e_rewards': list(self.episode_e_rewards),
+                'ppo_update_time_saved': self.ppo_update_time_saved,
+            }
+            for name, module in self.curiosity_modules.items():
+                checkpoint[name] = module.state_dict()
+            self.checkpoint_writer.save(checkpoint, self.update_index)
+        self._call_hooks('save')
+
+    def log_histograms(self):
+        with phase('logging'):
+            for name, param in self.actor_critic.named_parameters():
+                self.tensorboard_writer.add_histogram('parameters/' + name, param, self.total_num_steps)
+
+    def log(self):
+        """Print the training progress and write it to tensorboard."""
+        args, agent, writer = self.args, self.agent, self.tensorboard_writer
+        episode_rewards, total_num_steps, j = self.episode_rewards, self.total_num_steps, self.update_index
+        stats = self.update_stats
+
+        log_start = time.perf_counter()
+        end = time.time()
+        print("Updates {}, num timesteps {}, FPS {} \n Last {} training episodes: mean/median reward {:.1f}/{:.1f}, min/max reward {:.1f}/{:.1f}\n".
+            format(j, total_num_steps,
+                   int((total_num_steps - self.start_num_steps) / (end - self.start_time)),
+                   len(episode_rewards),
+                   np.mean(episode_rewards),
+                   np.median(episode_rewards),
+                   np.min(episode_rewards),
+                   np.max(episode_rewards)))
+
+        # from this PR: https://github.com/ikostrikov/pytorch-a2c-ppo-acktr/pull/140/files
+        writer.add_scalar("mean_reward", np.mean(episode_rewards), total_num_steps)
+        writer.add_scalar("median_reward", np.median(episode_rewards), total_num_steps)
+        writer.add_scalar("min_reward", np.min(episode_rewards), total_num_steps)
+        writer.add_scalar("max_reward", np.max(episode_rewards), total_num_steps)
+        for name in ['dist_entropy', 'value_loss', 'action_loss', 'update_time']:
+            writer.add_scalar(name, stats[name], total_num_steps)
+        if self.thread_scheduler.speedup is not None:
+            writer.add_scalar("update_thread_speedup", self.thread_scheduler.speedup, total_num_steps)
+
+        if args.algo == 'ppo':
+            for name, value in agent.stats.items():
+                writer.add_scalar(name, value, total_num_steps)
+
+        if args.algo == 'acktr' and args.kfac_async_eig:
+            writer.add_scalar("kfac_eig_staleness", agent.optimizer.eig_staleness, total_num_steps)
+            writer.add_scalar("kfac_eig_skipped", agent.optimizer.eig_worker.skipped, total_num_steps)
+
+        if args.algo == 'ppo' and args.target_kl is not None:
+            writer.add_scalar("ppo_epochs_run", agent.epochs_run, total_num_steps)
+            # Includes the minibatch passes computed before the KL check stopped them
+            writer.add_scalar("ppo_update_time_saved", self.ppo_update_time_saved, total_num_steps)
+
+        if args.curiosity:
+            writer.add_scalar("mean_intrinsic_reward", np.mean(self.episode_i_rewards), total_num_steps)
+            writer.add_scalar("mean_extrinsic_reward", np.mean(self.episode_e_rewards), total_num_steps)
+
+        if self.transition_cache_stats is not None:
+            # Of the env that finished an episode last
+            writer.add_scalar("transition_cache_hit_rate", self.transition_cache_stats['hit_rate'], total_num_steps)
+            writer.add_scalar("transition_cache_time_saved", self.transition_cache_stats['time_saved'],
+                              total_num_steps)
+
+        if args.log_histograms:
+            writer.add_scalar("histograms_dropped", writer.dropped, total_num_steps)
+
+        # Seconds spent in each phase since the last log, the time of this
+        # logging block is counted in the next interval
+        phase_times = timer.summary()
+        for name, phase_stats in phase_times['phases'].items():
+            writer.add_scalar('time/' + name, phase_stats['time'], total_num_steps)
+        writer.add_scalar('time/interval', phase_times['interval'], total_num_steps)
+        self.timing_log.write(json.dumps(dict(update=j, total_num_steps=total_num_steps, **phase_times)) + '\n')
+        self.timing_log.flush()
+
+        writer.flush()
+        timer.add('logging', time.perf_counter() - log_start)
+        self._call_hooks('log')
+
+    def evaluate(self, num_episodes=10):
+        """Mean reward of the deterministic policy over num_episodes episodes of fresh envs."""
+        args, device, actor_critic = self.args, self.device, self.actor_critic
+
+        eval_start = time.perf_counter()
+        eval_envs = make_vec_envs(
+            args.env_name, args.seed + args.num_processes, args.num_processes,
+            args.gamma, self.eval_log_dir, args.add_timestep, device, True)
+
+        vec_norm = get_vec_normalize(eval_envs)
+        if vec_norm is not None:
+            vec_norm.eval()
+            vec_norm.ob_rms = get_vec_normalize(self.envs).ob_rms
+
+        eval_episode_rewards = []
+
+        obs = eval_envs.reset()
+        eval_recurrent_hidden_states = torch.zeros(args.num_processes,
+                        actor_critic.recurrent_hidden_state_size, device=device)
+        eval_masks = torch.zeros(args.num_processes, 1, device=device)
+
+        while len(eval_episode_rewards) < num_episodes:
+            with torch.no_grad():
+                _, action, _, eval_recurrent_hidden_states = actor_critic.act(
+                    obs, eval_recurrent_hidden_states, eval_masks, deterministic=True)
+
+            # Obser reward and next obs
+            obs, reward, done, infos = eval_envs.step(action)
+
+            eval_masks = torch.FloatTensor([[0.0] if done_ else [1.0]
+                                            for done_ in done])
+            for info in infos:
+                if 'episode' in info.keys():
+                    eval_episode_rewards.append(info['episode']['r'])
+
+        eval_envs.close()
+
+        print(" Evaluation using {} episodes: mean reward {:.5f}\n".
+            format(len(eval_episode_rewards),
+                   np.mean(eval_episode_rewards)))
+        timer.add('eval', time.perf_counter() - eval_start)
+
+        self.eval_episode_rewards = eval_episode_rewards
+        self._call_hooks('evaluate')
+        return np.mean(eval_episode_rewards)
+
+    def step(self):
+        """One update of main.py's loop, with the saving, logging and evaluation due at it."""
+        args, j, is_chief = self.args, self.update_index, self.is_chief
+
+        self.collect()
+        self.update()
+
+        # save for every interval-th episode or for the last epoch
+        if j % args.save_interval == 0 or j == self.num_updates - 1:
+            self.save()
+
+        # Putting this separate because I want to save the initial weights to see the change
+        if j % args.log_interval == 0 and is_chief and args.log_histograms:
+            self.log_histograms()
+
+        if j % args.log_interval == 0 and len(self.episode_rewards) > 1 and is_chief:
+            self.log()
+
+        if (args.eval_interval is not None
+                and is_chief
+                and len(self.episode_rewards) > 1
+                and j % args.eval_interval == 0):
+            self.evaluate()
+
+        if args.vis and is_chief and j % args.vis_interval == 0:
+            self.plotter.plot()
+
+        self.update_index += 1
+
+    def train(self):
+        """Run the remaining updates, or until a hook calls stop()."""
+        self.start_num_steps = self.update_index * self.steps_per_update
+        self.start_time = time.time()
+        timer.reset()
+        while self.update_index < self.num_updates and not self.stopped:
+            self.step()
+
+    def close(self, close_envs=None):
+        """close_envs defaults to whether this run created its envs."""
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+
+        if self.is_chief:
+            self.tensorboard_writer.close()
+            self.timing_log.close()
+            if self.args.vis:
+                self.plotter.close()
+
+        # The eigenbasis thread would keep the optimizer and its factors alive
+        eig_worker = getattr(self.agent.optimizer, 'eig_worker', None)
+        if eig_worker is not None:
+            eig_worker.close()
+
+        if close_envs is None:
+            close_envs = self.owns_envs
+        if close_envs:
+            self.envs.close()
@@ -1,8 +1,8 @@
+import contextlib
+
 import torch
 import torch.nn as nn
 
-from envs import VecNormalize
-
 
 # Get a render function
 def get_render_func(venv):
@@ -17,6 +17,9 @@ def get_render_func(venv):
 
 
 def get_vec_normalize(venv):
+    # envs needs baselines, models and agents importing utils should not
+    from envs import VecNormalize
+
     if isinstance(venv, VecNormalize):
         return venv
     elif hasattr(venv, 'venv'):
@@ -39,6 +42,27 @@ class AddBias(nn.Module):
 
         return x + bias
 
+class SplitBias(nn.Module):
+    def __init__(self, module):
+        super(SplitBias, self).__init__()
+        self.module = module
+        self.add_bias = AddBias(module.bias.data)
+        self.module.bias = None
+
+    def forward(self, input):
+        x = self.module(input)
+        x = self.add_bias(x)
+        return x
+
+
+def split_bias(module):
+    """Move the biases of all layers into separate AddBias layers, in place."""
+    for mname, child in module.named_children():
+        if hasattr(child, 'bias') and child.bias is not None:
+            module._modules[mname] = SplitBias(child)
+        else:
+            split_bias(child)
+
 def update_linear_schedule(optimizer, epoch, total_num_epochs, initial_lr):
     """Decreases the learning rate linearly"""
     lr = initial_lr - (initial_lr * (epoch / float(total_num_epochs)))
@@ -49,3 +73,11 @@ def init(module, weight_init, bias_init, gain=1):
     weight_init(module.weight.data, gain=gain)
     bias_init(module.bias.data)
     return module
+
+
+def bf16_autocast(enabled, device):
+    """Autocast the enclosed forward pass to bfloat16 (no-op if disabled)."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type,
+                          dtype=torch.bfloat16)
@@ -3,8 +3,12 @@
 # Thanks to the author and OpenAI team!
 
 import glob
+import io
 import json
 import os
+import queue
+import threading
+import traceback
 
 import matplotlib
 matplotlib.use('Agg')
@@ -27,55 +31,164 @@ def smooth_reward_curve(x, y):
 
 
 def fix_point(x, y, interval):
-    np.insert(x, 0, 0)
-    np.insert(y, 0, 0)
-
-    fx, fy = [], []
-    pointer = 0
-
-    ninterval = int(max(x) / interval + 1)
-
-    for i in range(ninterval):
-        tmpx = interval * i
-
-        while pointer + 1 < len(x) and tmpx > x[pointer + 1]:
-            pointer += 1
-
-        if pointer + 1 < len(x):
-            alpha = (y[pointer + 1] - y[pointer]) / \
-                (x[pointer + 1] - x[pointer])
-            tmpy = y[pointer] + alpha * (tmpx - x[pointer])
-            fx.append(tmpx)
-            fy.append(tmpy)
-
+    """y linearly interpolated at the multiples of interval up to max(x), x increasing."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if len(x) < 2:
+        return np.zeros(0), np.zeros(0)
+
+    fx = interval * np.arange(int(x[-1] / interval + 1), dtype=np.float64)
+    fx = fx[fx <= x[-1]]
+    fy = np.interp(fx, x, y)
+
+    # Points before x[0] (when smoothing cut the start) are extrapolated along the first segment
+    before = fx < x[0]
+    fy[before] = y[0] + (y[1] - y[0]) / (x[1] - x[0]) * (fx[before] - x[0])
     return fx, fy
 
 
-def load_data(indir, smooth, bin_size):
-    datas = []
-    infiles = glob.glob(os.path.join(indir, '*.monitor.csv'))
-
-    for inf in infiles:
-        with open(inf, 'r') as f:
-            f.readline()
-            f.readline()
-            for line in f:
-                tmp = line.split(',')
-                t_time = float(tmp[2])
-                tmp = [t_time, int(tmp[1]), float(tmp[0])]
-                datas.append(tmp)
-
-    datas = sorted(datas, key=lambda d_entry: d_entry[0])
-    result = []
-    timesteps = 0
-    for i in range(len(datas)):
-        result.append([timesteps, datas[i][-1]])
-        timesteps += datas[i][1]
-
-    if len(result) < bin_size:
+class MonitorReader(object):
+    """Incrementally reads the episodes of the *.monitor.csv files of a directory.
+
+    Every read() parses only the complete rows appended since the previous
+    one, starting at the remembered byte offset of each file, and returns
+    all episodes so far as a structured array sorted by absolute end time
+    (t_start of the file + t).
+
+    With episode_log, the parsed rows of <name>.monitor.csv are also appended
+    to a binary columnar log, one file per column: <name>.monitor.episodes.t
+    and .r of float64, .l of int32, with the number of rows and the CSV
+    offset they cover in <name>.monitor.episodes.json. A new reader, e.g. in
+    a new plotting process, loads them with np.fromfile and only parses the
+    rest of the CSV.
+    """
+    dtype = np.dtype([('t', '<f8'), ('l', '<i4'), ('r', '<f8')])
+
+    def __init__(self, indir, episode_log=False):
+        self.indir = indir
+        self.episode_log = episode_log
+        self.files = {}
+
+        self._buffer = np.zeros(0, dtype=self.dtype)
+        self._size = 0
+
+    @property
+    def episodes(self):
+        return self._buffer[:self._size]
+
+    def read(self):
+        new = []
+        for path in sorted(glob.glob(os.path.join(self.indir, '*.monitor.csv'))):
+            if path not in self.files:
+                self.files[path], rows = self._open(path)
+                new.append(rows)
+            new.append(self._update(path, self.files[path]))
+
+        new = [rows for rows in new if len(rows)]
+        if new:
+            new = np.concatenate(new)
+            new = new[np.argsort(new['t'], kind='stable')]
+            if self._size and new['t'][0] < self._buffer['t'][self._size - 1]:
+                # Rows of another file that are older than the last ones we have
+                merged = np.concatenate([self.episodes, new])
+                self._buffer = merged[np.argsort(merged['t'], kind='stable')]
+                self._size = len(merged)
+            else:
+                self._append(new)
+        return self.episodes
+
+    def _append(self, rows):
+        if self._size + len(rows) > len(self._buffer):
+            buffer = np.zeros(max(2 * len(self._buffer), self._size + len(rows)), dtype=self.dtype)
+            buffer[:self._size] = self.episodes
+            self._buffer = buffer
+        self._buffer[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def _open(self, path):
+        state = {'offset': 0, 't_start': None, 'columns': None, 'rows': 0}
+        rows = np.zeros(0, dtype=self.dtype)
+        if not self.episode_log:
+            return state, rows
+
+        log_path = path[:-len('.csv')] + '.episodes'
+        try:
+            with open(log_path + '.json') as f:
+                saved = json.load(f)
+            with open(path, 'rb') as f:
+                t_start = json.loads(f.readline()[1:].decode())['t_start']
+        except (IOError, ValueError, KeyError):
+            saved = None
+        if saved is not None and saved['t_start'] == t_start:
+            columns = {name: np.fromfile(log_path + '.' + name, dtype=self.dtype[name], count=saved['rows'])
+                       if os.path.exists(log_path + '.' + name) else np.zeros(0, dtype=self.dtype[name])
+                       for name in self.dtype.names}
+            if all(len(column) == saved['rows'] for column in columns.values()):
+                state.update(saved)
+                rows = np.zeros(saved['rows'], dtype=self.dtype)
+                for name, column in columns.items():
+                    rows[name] = column
+        for name in self.dtype.names:
+            # Records written after the last offset update are parsed again from the CSV
+            with open(log_path + '.' + name, 'ab') as f:
+                f.truncate(state['rows'] * self.dtype[name].itemsize)
+        return state, rows
+
+    def _update(self, path, state):
+        with open(path, 'rb') as f:
+            f.seek(state['offset'])
+            data = f.read()
+        # Only complete lines, the last one may still be written
+        data = data[:data.rfind(b'\n') + 1]
+
+        if state['columns'] is None:
+            # '#{"t_start": ...}' and the column names
+            lines = data.split(b'\n', 2)
+            if len(lines) < 3:
+                return np.zeros(0, dtype=self.dtype)
+            state['t_start'] = json.loads(lines[0][1:].decode())['t_start']
+            names = lines[1].decode().strip().split(',')
+            state['columns'] = [names.index(name) for name in ['t', 'l', 'r']]
+            state['offset'] += len(lines[0]) + len(lines[1]) + 2
+            data = lines[2]
+
+        if not data.strip():
+            return np.zeros(0, dtype=self.dtype)
+        parsed = np.loadtxt(io.StringIO(data.decode()), delimiter=',', usecols=state['columns'],
+                            ndmin=2, dtype=np.float64)
+        rows = np.zeros(len(parsed), dtype=self.dtype)
+        rows['t'] = parsed[:, 0] + state['t_start']
+        rows['l'] = parsed[:, 1]
+        rows['r'] = parsed[:, 2]
+        state['offset'] += len(data)
+
+        if self.episode_log:
+            log_path = path[:-len('.csv')] + '.episodes'
+            for name in self.dtype.names:
+                with open(log_path + '.' + name, 'ab') as f:
+                    rows[name].tofile(f)
+            state['rows'] += len(rows)
+            # The offset is only recorded once the records are written
+            with open(log_path + '.json.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(log_path + '.json.tmp', log_path + '.json')
+        return rows
+
+
+_readers = {}
+
+
+def load_data(indir, smooth, bin_size, episode_log=False):
+    # The reader of a directory is kept, later calls only parse new episodes
+    if indir not in _readers:
+        _readers[indir] = MonitorReader(indir, episode_log)
+    episodes = _readers[indir].read()
+
+    if len(episodes) < bin_size:
         return [None, None]
 
-    x, y = np.array(result)[:, 0], np.array(result)[:, 1]
+    # Timesteps before every episode and its reward
+    x = np.concatenate([[0.], np.cumsum(episodes['l'], dtype=np.float64)[:-1]])
+    y = episodes['r']
 
     if smooth == 1:
         x, y = smooth_reward_curve(x, y)
@@ -101,8 +214,8 @@ color_defaults = [
 ]
 
 
-def visdom_plot(viz, win, folder, game, name, num_steps, bin_size=100, smooth=1):
-    tx, ty = load_data(folder, smooth, bin_size)
+def visdom_plot(viz, win, folder, game, name, num_steps, bin_size=100, smooth=1, episode_log=False):
+    tx, ty = load_data(folder, smooth, bin_size, episode_log)
     if tx is None or ty is None:
         return win
 
@@ -123,8 +236,8 @@ def visdom_plot(viz, win, folder, game, name, num_steps, bin_size=100, smooth=1)
     plt.show()
     plt.draw()
 
-    image = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
-    image = image.reshape(fig.canvas.get_width_height()[::-1] + (3, ))
+    fig.canvas.draw()
+    image = np.array(fig.canvas.buffer_rgba())[:, :, :3]
     plt.close(fig)
 
     # Show it in visdom
@@ -132,6 +245,49 @@ def visdom_plot(viz, win, folder, game, name, num_steps, bin_size=100, smooth=1)
     return viz.image(image, win=win)
 
 
+class VisdomPlotter(object):
+    """Runs visdom_plot on a background thread so plotting does not block training.
+
+    plot() only requests a plot; requests made while one is still pending
+    are merged into it.
+    """
+    def __init__(self, viz, folder, game, name, num_steps, episode_log=False):
+        self.viz = viz
+        self.win = None
+        self.plot_args = (folder, game, name, num_steps)
+        self.episode_log = episode_log
+
+        self._requests = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def plot(self):
+        try:
+            self._requests.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def close(self):
+        # A pending plot is dropped, so the stop request always fits in the queue
+        try:
+            self._requests.get_nowait()
+        except queue.Empty:
+            pass
+        self._requests.put_nowait(None)
+        self._thread.join()
+
+    def _run(self):
+        while self._requests.get() is not None:
+            try:
+                self.win = visdom_plot(self.viz, self.win, *self.plot_args, episode_log=self.episode_log)
+            except IOError:
+                # Sometimes monitor doesn't properly flush the outputs
+                pass
+            except Exception:
+                # A bad monitor row or a visdom error only loses this plot
+                traceback.print_exc()
+
+
 if __name__ == "__main__":
     from visdom import Visdom
     viz = Visdom()
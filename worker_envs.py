@@ -0,0 +1,219 @@
+"""Building single gym envs, the part of envs.py that runs in the env workers.
+
+This module imports neither torch nor the training code so spawned workers
+start quickly, and the packages registering extra envs (PLE, gridworlds,
+roboschool, ...) are only imported when the env id needs them.
+"""
+import importlib
+import os
+import time
+import warnings
+from collections import OrderedDict
+
+import gym
+import numpy as np
+from gym.spaces.box import Box
+
+from baselines import bench
+
+
+# Packages that register gym envs when imported, in the order they are tried
+# for env ids gym does not know. Ids containing a hint try its package first.
+ENV_PACKAGES = ['gym_ple', 'gym_nv_ple', 'gridworlds.registration', 'roboschool', 'pybullet_envs']
+ENV_PACKAGE_HINTS = [('Roboschool', 'roboschool'), ('Bullet', 'pybullet_envs')]
+
+
+def is_registered(env_id):
+    try:
+        gym.spec(env_id)
+    except gym.error.Error:
+        return False
+    return True
+
+
+def register_env_packages(env_id):
+    """Import the packages needed to gym.make(env_id), stopping at the first that registers it."""
+    if env_id.startswith("dm") or is_registered(env_id):
+        return
+    packages = [package for hint, package in ENV_PACKAGE_HINTS if hint in env_id]
+    packages += [package for package in ENV_PACKAGES if package not in packages]
+    for package in packages:
+        try:
+            importlib.import_module(package)
+        except ImportError:
+            continue
+        if is_registered(env_id):
+            return
+
+
+def make_env(env_id, seed, rank, log_dir, add_timestep, allow_early_resets, log_suffix='',
+             transition_cache_mb=None):
+    def _thunk():
+        if env_id.startswith("dm"):
+            import dm_control2gym
+            _, domain, task = env_id.split('.')
+            env = dm_control2gym.make(domain_name=domain, task_name=task)
+        else:
+            register_env_packages(env_id)
+            env = gym.make(env_id)
+
+        is_atari = hasattr(gym.envs, 'atari') and isinstance(
+            env.unwrapped, gym.envs.atari.atari_env.AtariEnv)
+        if is_atari:
+            from baselines.common.atari_wrappers import make_atari, wrap_deepmind
+            env = make_atari(env_id)
+
+        env.seed(seed + rank)
+
+        if transition_cache_mb is not None:
+            env = cache_transitions(env, transition_cache_mb)
+
+        obs_shape = env.observation_space.shape
+
+        if add_timestep and len(
+                obs_shape) == 1 and str(env).find('TimeLimit') > -1:
+            env = AddTimestep(env)
+
+        if log_dir is not None:
+            env = bench.Monitor(env, os.path.join(log_dir, str(rank) + log_suffix),
+                                allow_early_resets=allow_early_resets)
+
+        if is_atari:
+            if len(env.observation_space.shape) == 3:
+                env = wrap_deepmind(env)
+        elif len(env.observation_space.shape) == 3:
+            raise NotImplementedError("CNN models work only for atari,\n"
+                "please use a custom wrapper for a custom pixel input env.\n"
+                "See wrap_deepmind for an example.")
+        
+        # If the input has shape (W,H,3), wrap for PyTorch convolutions
+        obs_shape = env.observation_space.shape
+        if len(obs_shape) == 3 and obs_shape[2] in [1, 3]:
+            env = TransposeImage(env)
+
+        return env
+
+    return _thunk
+
+
+class TransitionCache(gym.Wrapper):
+    """Memoizes the transitions of a deterministic environment.
+
+    The env has to implement get_state(), returning a hashable state, and
+    set_state(state). (state, action) keys map to (next state, obs, reward,
+    done); on a hit the env is moved to the next state instead of stepped
+    and the info is empty.
+    The least recently used transitions are evicted to stay under max_mb.
+    Cache statistics are added to the info of the last step of an episode.
+    """
+    def __init__(self, env, max_mb):
+        super(TransitionCache, self).__init__(env)
+        self.max_bytes = max_mb * 2 ** 20
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.miss_time = 0.
+
+    def _key(self, action):
+        if isinstance(action, np.ndarray):
+            action = action.tobytes()
+        return self.env.get_state(), action
+
+    def step(self, action):
+        key = self._key(action)
+        transition = self.cache.get(key)
+        if transition is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            next_state, obs, reward, done = transition
+            self.env.set_state(next_state)
+            obs, info = obs.copy(), {}
+        else:
+            self.misses += 1
+            start = time.perf_counter()
+            obs, reward, done, info = self.env.step(action)
+            self.miss_time += time.perf_counter() - start
+            self._insert(key, (self.env.get_state(), np.array(obs), reward, done))
+
+        if done:
+            info = dict(info, transition_cache=self.stats())
+        return obs, reward, done, info
+
+    def _insert(self, key, transition):
+        # Rough size of an entry, the observation dominates
+        self.cache_bytes += transition[1].nbytes + 256
+        self.cache[key] = transition
+        while self.cache_bytes > self.max_bytes and self.cache:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= old[1].nbytes + 256
+
+    def stats(self):
+        steps = self.hits + self.misses
+        return {
+            'hit_rate': self.hits / max(steps, 1),
+            'time_saved': self.hits * self.miss_time / max(self.misses, 1),
+            'size_mb': self.cache_bytes / 2 ** 20,
+        }
+
+
+def cache_transitions(env, max_mb):
+    """Put a TransitionCache right around the unwrapped env.
+
+    The wrappers above it (e.g. TimeLimit) still see every step. Envs that
+    are stochastic (a `stochastic` attribute or a nondeterministic spec) or
+    that do not expose their state are left alone.
+    """
+    unwrapped = env.unwrapped
+    spec = getattr(env, 'spec', None)
+    name = getattr(spec, 'id', unwrapped)
+    if getattr(unwrapped, 'stochastic', False) or getattr(spec, 'nondeterministic', False):
+        warnings.warn('Not caching the transitions of the stochastic env {}'.format(name))
+        return env
+    if not (hasattr(unwrapped, 'get_state') and hasattr(unwrapped, 'set_state')):
+        warnings.warn('Not caching the transitions of {}, it has no get_state/set_state'.format(name))
+        return env
+
+    if not isinstance(env, gym.Wrapper):
+        return TransitionCache(env, max_mb)
+    wrapper = env
+    while isinstance(wrapper.env, gym.Wrapper):
+        wrapper = wrapper.env
+    wrapper.env = TransitionCache(wrapper.env, max_mb)
+    return env
+
+
+# Can be used to test recurrent policies for Reacher-v2
+class MaskGoal(gym.ObservationWrapper):
+    def observation(self, observation):
+        if self.env._elapsed_steps > 0:
+            observation[-2:0] = 0
+        return observation
+
+
+class AddTimestep(gym.ObservationWrapper):
+    def __init__(self, env=None):
+        super(AddTimestep, self).__init__(env)
+        self.observation_space = Box(
+            self.observation_space.low[0],
+            self.observation_space.high[0],
+            [self.observation_space.shape[0] + 1],
+            dtype=self.observation_space.dtype)
+
+    def observation(self, observation):
+        return np.concatenate((observation, [self.env._elapsed_steps]))
+
+
+class TransposeImage(gym.ObservationWrapper):
+    def __init__(self, env=None):
+        super(TransposeImage, self).__init__(env)
+        obs_shape = self.observation_space.shape
+        self.observation_space = Box(
+            self.observation_space.low[0, 0, 0],
+            self.observation_space.high[0, 0, 0],
+            [obs_shape[2], obs_shape[1], obs_shape[0]],
+            dtype=self.observation_space.dtype)
+
+    def observation(self, observation):
+        return observation.transpose(2, 0, 1)